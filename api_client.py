@@ -1,115 +1,493 @@
 import time
 import json
+import copy
 import requests
 import os
+import threading
+import contextvars
+import hashlib
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from cache import LRUCache, DiskCache, TieredCache, ResponseCache
+from concurrency import ConcurrencyGovernor, SingleFlight
+from journal import RequestJournal
+from library_store import LibraryStore
+from library_index import LibraryIndex
+from search_index import SearchIndex
+
+# Upper bound for concurrent per-tab fetches while building the library.
+LIBRARY_FETCH_WORKERS = int(os.environ.get("SPEEDIANCE_LIBRARY_WORKERS", 8))
+# Bounds for the adaptive limit on in-flight upstream requests shared by all fan-outs.
+# Worker pools may be larger; their threads simply wait for a free slot.
+UPSTREAM_CONCURRENCY_INITIAL = int(os.environ.get("SPEEDIANCE_CONCURRENCY_INITIAL", 6))
+UPSTREAM_CONCURRENCY_MAX = int(os.environ.get("SPEEDIANCE_CONCURRENCY_MAX", 24))
+# Connection pool sizing for the shared keep-alive session (per host). The pool keeps
+# as many connections as the governor lets requests run, so none are discarded and
+# reopened at peak concurrency; the governor is capped to the pool if it is set lower.
+POOL_CONNECTIONS = int(os.environ.get("SPEEDIANCE_POOL_CONNECTIONS", 4))
+POOL_MAXSIZE = int(os.environ.get("SPEEDIANCE_POOL_MAXSIZE", UPSTREAM_CONCURRENCY_MAX))
+
+# Batched detail fetching (actionLibraryGroup/list). The chunk size adapts between
+# the bounds below so that one chunk takes roughly DETAIL_TARGET_LATENCY seconds,
+# and is always capped so the query string stays under MAX_URL_LENGTH.
+DETAIL_FETCH_WORKERS = int(os.environ.get("SPEEDIANCE_DETAIL_WORKERS", 4))
+DETAIL_CHUNK_SIZE = 50
+DETAIL_CHUNK_MIN = 10
+DETAIL_CHUNK_MAX = 150
+DETAIL_TARGET_LATENCY = 1.5
+MAX_URL_LENGTH = 6000
+# A failed chunk is split in half to isolate bad ids: at most DETAIL_SPLIT_MAX_DEPTH times
+# (enough to reach single ids of a DETAIL_CHUNK_MAX chunk) and for at most
+# DETAIL_RETRY_BUDGET retried requests per fetch. Transient failures (connection errors,
+# 429, 5xx) are not split at all: smaller requests would fail the same way.
+DETAIL_SPLIT_MAX_DEPTH = 8
+DETAIL_RETRY_BUDGET = 40
+# Listing fields that, when they differ from the cached details, mark a group as changed
+# during an incremental library sync.
+LIBRARY_CHANGE_FIELDS = ("updateTime", "updatedTime", "gmtModified", "version", "title", "img")
+
+# SQLite library store shared by all device/monster-move variants. The old per-variant
+# JSON files (library_cache_v2_*.json) are imported once when found.
+LIBRARY_DB = "library_cache.db"
+
+# Exercise detail cache: memory LRU plus one JSON file per exercise and account on disk.
+# Only detail responses go in; list responses omit fields the detail endpoint returns
+# (isLeftRight, templatePresetList, ...) and only feed the group-meta index.
+DETAIL_CACHE_DIR = "exercise_detail_cache"
+DETAIL_CACHE_MAX_ENTRIES = 1024
+DETAIL_CACHE_TTL = 14 * 24 * 3600
+
+# Response cache for read-only GET endpoints, matched by path prefix.
+# "vary" lists the request context values that are part of the cache key.
+RESPONSE_CACHE_POLICIES = {
+    "accessories": {"path": "/api/app/accessories/list", "ttl": 24 * 3600, "max_entries": 4, "vary": ("region",)},
+    "categories": {"path": "/api/app/actionLibraryTab/list", "ttl": 24 * 3600, "max_entries": 8, "vary": ("region", "device_type")},
+    "courses_page": {"path": "/api/app/v2/course/page", "ttl": 6 * 3600, "max_entries": 40, "vary": ("region", "user")},
+    "course_detail": {"path": "/api/app/v2/course/info/", "ttl": 24 * 3600, "max_entries": 500, "vary": ("region", "user")},
+    "programs_page": {"path": "/api/mobile/exclusivePlan/page", "ttl": 6 * 3600, "max_entries": 20, "vary": ("region", "user")},
+    "program_detail": {"path": "/api/app/exclusivePlan/", "ttl": 24 * 3600, "max_entries": 200, "vary": ("region", "user")},
+}
+# Optional SQLite file that receives entries evicted from memory.
+RESPONSE_CACHE_DB = os.environ.get("SPEEDIANCE_RESPONSE_CACHE_DB") or None
+# Request header that skips the cache lookup (the fresh response is still stored).
+CACHE_BYPASS_HEADER = "X-Cache-Bypass"
+
+# Request journal (/debug/last_response): ring buffer size and sampling rate (0 = off).
+JOURNAL_SIZE = int(os.environ.get("SPEEDIANCE_JOURNAL_SIZE", 50))
+JOURNAL_SAMPLE_RATE = float(os.environ.get("SPEEDIANCE_JOURNAL_SAMPLE", 1.0))
+
+_cache_bypass = contextvars.ContextVar("speediance_cache_bypass", default=False)
+
+# Marks a library that has not been read from the store yet (None means "no library").
+_NOT_LOADED = object()
+
+
+# Settings stored in config.json, with their defaults and types.
+DEFAULT_CONFIG = {
+    "user_id": "",
+    "token": "",
+    "region": "Global",
+    "unit": 0,
+    "custom_instruction": "",
+    "device_type": 1,
+    "allow_monster_moves": False,
+    "owned_accessories": [],
+    "owned_devices": [],
+}
+SETTING_TYPES = {
+    "user_id": str,
+    "token": str,
+    "unit": int,
+    "device_type": int,
+    "allow_monster_moves": bool,
+    "owned_accessories": list,
+    "owned_devices": list,
+}
+
+
+class UpstreamStatusError(Exception):
+    """Non-200 answer from an endpoint that must not fail silently."""
+
+    def __init__(self, status):
+        super().__init__(f"Status {status}")
+        self.status = status
+
+
+def _is_transient(error):
+    """True for failures that retrying a smaller request would not fix."""
+    if isinstance(error, requests.exceptions.RequestException):
+        return True
+    status = getattr(error, 'status', None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def _host_for_region(region):
+    return "euapi.speediance.com" if region == "EU" else "api2.speediance.com"
+
+
+class SharedResources:
+    """
+    Reference data shared by every client of a process, whichever account it serves:
+    the library store and the in-memory library per variant, exercise details (keyed
+    per account), the response cache (user-specific policies vary by user), the
+    upstream concurrency limit and the single-flight registry.
+    """
 
-class SpeedianceClient:
     def __init__(self):
-        self.config_file = "config.json"
+        self.library_store = LibraryStore(LIBRARY_DB)
+        self.libraries = {}  # variant -> library list (None = not built)
+        self.library_lock = threading.Lock()
+        self.library_indexes = {}  # variant -> LibraryIndex of that library
+        self.search_indexes = {}  # variant -> SearchIndex, synced with the LibraryIndex
+        self.detail_cache = TieredCache(
+            LRUCache(DETAIL_CACHE_MAX_ENTRIES, DETAIL_CACHE_TTL),
+            DiskCache(DETAIL_CACHE_DIR, DETAIL_CACHE_TTL),
+        )
+        self.response_cache = ResponseCache(RESPONSE_CACHE_POLICIES, RESPONSE_CACHE_DB)
+        self.governor = ConcurrencyGovernor(
+            min(UPSTREAM_CONCURRENCY_INITIAL, POOL_MAXSIZE), maximum=min(UPSTREAM_CONCURRENCY_MAX, POOL_MAXSIZE))
+        self.inflight = SingleFlight()
+
+
+class SpeedianceClient:
+    # Tuned at runtime by fetch_batch_details()
+    detail_chunk_size = DETAIL_CHUNK_SIZE
+
+    def __init__(self, config_file="config.json", shared=None):
+        shared = shared or SharedResources()
+        self.config_file = config_file
+        # Serialises config changes. credentials is replaced as a whole, never mutated,
+        # so request threads can read it (or keep a reference) without locking.
+        self._config_lock = threading.RLock()
         self.credentials = self.load_config()
         self.region = self.credentials.get("region", "Global")
         self.device_type = int(self.credentials.get("device_type", 1))
         self.allow_monster_moves = bool(self.credentials.get("allow_monster_moves", False))
-        self.base_url = "https://euapi.speediance.com" if self.region == "EU" else "https://api2.speediance.com"
-        self.host = "euapi.speediance.com" if self.region == "EU" else "api2.speediance.com"
+        self.host = _host_for_region(self.region)
+        self.base_url = "https://" + self.host
+        self.library_store = shared.library_store
         self.library_cache_file = self._get_library_cache_file()
-        self.library_cache = self._load_library_cache()
-        self.last_debug_info = {}
+        # Libraries are read from the store on first use (or by warm_library_cache) so
+        # startup stays fast, and are shared by all clients on the same variant
+        self._libraries = shared.libraries
+        self._library_lock = shared.library_lock
+        self._library_indexes = shared.library_indexes
+        self._search_indexes = shared.search_indexes
+        self.journal = RequestJournal(JOURNAL_SIZE, JOURNAL_SAMPLE_RATE)
+        self._group_meta = {}
+        self._group_meta_library = None
+        self.detail_cache = shared.detail_cache
+        self.response_cache = shared.response_cache
+        self.governor = shared.governor
+        self._inflight = shared.inflight
+        self._session_lock = threading.Lock()
+        self.session = self._build_session()
+        self.preconnect()
+
+    def _build_session(self):
+        """Creates a keep-alive session with a bounded connection pool per host."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _reset_session(self):
+        """Replaces the pooled session (e.g. after a region switch) and warms the new host."""
+        with self._session_lock:
+            old_session = self.session
+            self.session = self._build_session()
+        try:
+            old_session.close()
+        except Exception:
+            pass
+        self.preconnect()
+
+    def close(self):
+        """Releases this client's connection pool (shared caches are left alone)."""
+        with self._session_lock:
+            session = self.session
+        session.close()
+
+    def preconnect(self):
+        """Opens a connection to the current host in the background so the TLS handshake is already done."""
+        session = self.session
+        url = self.base_url
+
+        def warm():
+            try:
+                session.head(url, timeout=5)
+            except Exception:
+                pass
+
+        threading.Thread(target=warm, daemon=True).start()
+
+    def set_region(self, region):
+        """Points the client at the Global or EU API and rebuilds the connection pool if the host changed."""
+        with self._config_lock:
+            self.region = region
+            host = _host_for_region(region)
+            if host != self.host:
+                self.host = host
+                self.base_url = "https://" + host
+                self._reset_session()
 
     def _get_library_cache_file(self):
+        """Legacy JSON cache path, imported into the SQLite store on first load."""
         allow_flag = 1 if self.allow_monster_moves else 0
         return f"library_cache_v2_device{self.device_type}_allow{allow_flag}.json"
 
+    @property
+    def library_variant(self):
+        allow_flag = 1 if self.allow_monster_moves else 0
+        return f"device{self.device_type}_allow{allow_flag}"
+
     def _load_library_cache(self):
-        """Loads library from disk if available."""
-        if os.path.exists(self.library_cache_file):
-            try:
+        """Loads library from the SQLite store, importing a legacy JSON cache file once."""
+        try:
+            library = self.library_store.load(self.library_variant)
+            if library is not None:
+                return library
+            if os.path.exists(self.library_cache_file):
                 with open(self.library_cache_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error loading library cache: {e}")
+                    library = json.load(f)
+                self.library_store.replace(self.library_variant, library)
+                print(f"Imported {self.library_cache_file} into {LIBRARY_DB}")
+                return library
+        except Exception as e:
+            print(f"Error loading library cache: {e}")
         return None
 
-    def _save_library_cache(self, data):
-        """Saves library to disk."""
+    @property
+    def library_cache(self):
+        variant = self.library_variant
+        library = self._libraries.get(variant, _NOT_LOADED)
+        if library is _NOT_LOADED:
+            with self._library_lock:
+                library = self._libraries.get(variant, _NOT_LOADED)
+                if library is _NOT_LOADED:
+                    library = self._libraries[variant] = self._load_library_cache()
+        return library
+
+    @library_cache.setter
+    def library_cache(self, value):
+        if value is _NOT_LOADED:
+            self._libraries.pop(self.library_variant, None)
+        else:
+            self._libraries[self.library_variant] = value
+
+    def _loaded_library(self):
+        """The in-memory library, or None when it has not been read from the store yet."""
+        library = self._libraries.get(self.library_variant, _NOT_LOADED)
+        return None if library is _NOT_LOADED else library
+
+    def warm_library_cache(self):
+        """Reads the library from the store in a background thread."""
+        threading.Thread(target=lambda: self.library_cache, daemon=True).start()
+
+    def _save_library_cache(self, data, changed_ids=None, removed_ids=None):
+        """
+        Saves library to the store. Without changed_ids the variant is rewritten completely;
+        with them only those exercise rows are written (plus the small per-entry rows).
+        """
         try:
-            with open(self.library_cache_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False)
+            if changed_ids is None:
+                self.library_store.replace(self.library_variant, data)
+            else:
+                self.library_store.apply_delta(self.library_variant, data, changed_ids, removed_ids or [])
         except Exception as e:
             print(f"Error saving library cache: {e}")
 
+    def clear_library_cache(self):
+        """Forgets the current variant's library in memory and on disk."""
+        self.library_cache = None
+        try:
+            self.library_store.delete_variant(self.library_variant)
+        except Exception as e:
+            print(f"Error clearing library cache: {e}")
+        if os.path.exists(self.library_cache_file):
+            try:
+                os.remove(self.library_cache_file)
+            except Exception as e:
+                print(f"Error removing cache file: {e}")
+
+    @staticmethod
+    @contextmanager
+    def bypass_cache():
+        """Within this block, cached GET responses are ignored and refreshed from upstream."""
+        token = _cache_bypass.set(True)
+        try:
+            yield
+        finally:
+            _cache_bypass.reset(token)
+
+    def _cache_context(self):
+        return {
+            "device_type": self.device_type,
+            "region": self.region,
+            "user": self.credentials.get("user_id", ""),
+        }
+
+    @staticmethod
+    def _response_from_entry(url, entry):
+        """Builds a fresh Response from a (status, headers, content) tuple."""
+        status, headers, content = entry
+        resp = requests.Response()
+        resp.status_code = status
+        resp.headers = CaseInsensitiveDict(headers)
+        resp._content = content
+        resp.encoding = 'utf-8'
+        resp.url = url
+        return resp
+
+    def invalidate_response_cache(self, name=None):
+        """Drops cached responses for one policy (see RESPONSE_CACHE_POLICIES) or all of them."""
+        self.response_cache.invalidate(name)
+
     def _request(self, method, url, **kwargs):
-        """Wrapper for requests to capture debug info."""
+        """Wrapper for requests to capture debug info and serve cacheable GETs."""
+        headers = kwargs.get('headers') or {}
+        bypass = headers.pop(CACHE_BYPASS_HEADER, None) or _cache_bypass.get()
+        policy = self.response_cache.match(urlparse(url).path) if method == 'GET' else None
+        if policy:
+            cache_key = self.response_cache.key(policy, url, self._cache_context())
+            if not bypass:
+                cached = self.response_cache.get(policy, cache_key)
+                if cached is not None:
+                    return self._response_from_entry(url, cached)
+        else:
+            cache_key = None
+
+        if method != 'GET':
+            return self._send(method, url, policy, cache_key, **kwargs)
+
+        # Identical concurrent GETs share one upstream request; joiners get their own copy
+        flight_key = (url, headers.get("Token"))
+        resp, shared = self._inflight.do(flight_key, lambda: self._send(method, url, policy, cache_key, **kwargs))
+        if shared:
+            return self._response_from_entry(url, (resp.status_code, dict(resp.headers), resp.content))
+        return resp
+
+    def _send(self, method, url, policy, cache_key, **kwargs):
+        """Performs one upstream request: governor slot, journal entry, auth check, cache store."""
+        started = time.monotonic()
         try:
-            resp = requests.request(method, url, **kwargs)
-            
-            # Capture debug info
+            with self.governor.slot():
+                try:
+                    resp = self.session.request(method, url, **kwargs)
+                except Exception:
+                    self.governor.record(time.monotonic() - started, None)
+                    raise
+                elapsed = time.monotonic() - started
+                self.governor.record(elapsed, resp.status_code)
+
+            # Parse the body once; callers get the same object back from resp.json()
             try:
-                body_preview = resp.json()
-            except:
-                body_preview = resp.text[:500] + "..." if len(resp.text) > 500 else resp.text
-
-            self.last_debug_info = {
-                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                "method": method,
-                "url": url,
-                "status": resp.status_code,
-                "request_headers": dict(resp.request.headers),
-                "request_body": kwargs.get('json') or kwargs.get('data'),
-                "response_body": body_preview
-            }
-            
+                body = resp.json()
+                resp.json = lambda **_: body
+            except ValueError:
+                body = None
+
+            self.journal.record(
+                method, url,
+                status=resp.status_code,
+                elapsed=elapsed,
+                request_headers=resp.request.headers,
+                request_body=kwargs.get('json') or kwargs.get('data'),
+                response_content=resp.content,
+            )
+
             # Check for application-level auth error (Code 91)
-            if isinstance(body_preview, dict) and body_preview.get('code') == 91:
+            if isinstance(body, dict) and body.get('code') == 91:
                 raise Exception("Unauthorized")
-                
+
+            # Only successful API answers are worth caching
+            if policy and resp.status_code == 200 and isinstance(body, dict) and body.get('code') == 0:
+                self.response_cache.set(policy, cache_key, (resp.status_code, dict(resp.headers), resp.content))
+
             return resp
         except Exception as e:
-            self.last_debug_info = {
-                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                "method": method,
-                "url": url,
-                "error": str(e)
-            }
+            if str(e) != "Unauthorized":
+                self.journal.record(method, url, elapsed=time.monotonic() - started, error=str(e))
             raise e
 
+    @property
+    def last_debug_info(self):
+        """Most recent journal entry (kept for callers of the old single-slot debug info)."""
+        return self.journal.latest()
+
+    def gather(self, *calls):
+        """
+        Runs independent client calls concurrently and returns their results in order.
+        Each call is a tuple (method, *args). The first exception (in call order) is re-raised.
+        """
+        if len(calls) < 2:
+            return [func(*args) for func, *args in calls]
+        with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, func, *args) for func, *args in calls]
+            return [future.result() for future in futures]
+
     def load_config(self):
+        config = dict(DEFAULT_CONFIG)
         if os.path.exists(self.config_file):
             with open(self.config_file, 'r') as f:
-                return json.load(f)
-        return {
-            "user_id": "",
-            "token": "",
-            "region": "Global",
-            "unit": 0,
-            "custom_instruction": "",
-            "device_type": 1,
-            "allow_monster_moves": False,
-            "owned_accessories": [],
-            "owned_devices": [],
-        }
+                config.update(json.load(f))
+        return config
+
+    def update_settings(self, **fields):
+        """
+        Changes individual settings (keys of DEFAULT_CONFIG) and persists them atomically.
+        The library variant only changes when device_type or allow_monster_moves do.
+        """
+        unknown = set(fields) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+        for key, cast in SETTING_TYPES.items():
+            if key in fields:
+                fields[key] = cast(fields[key])
+
+        with self._config_lock:
+            credentials = dict(self.credentials, **fields)
+            if credentials == self.credentials:
+                return
+            self._persist_config(credentials)
+            self.credentials = credentials
+            if "region" in fields:
+                self.set_region(credentials["region"])
+            if credentials["device_type"] != self.device_type or credentials["allow_monster_moves"] != self.allow_monster_moves:
+                self.device_type = credentials["device_type"]
+                self.allow_monster_moves = credentials["allow_monster_moves"]
+                self.library_cache_file = self._get_library_cache_file()
+
+    def _persist_config(self, credentials):
+        """Writes config.json via a temp file and rename, so it is never left half written."""
+        tmp_path = f"{self.config_file}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(credentials, f)
+            os.replace(tmp_path, self.config_file)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
 
     def save_config(self, user_id, token, region="Global", unit=0, custom_instruction="", device_type=1, allow_monster_moves=False, owned_accessories=None, owned_devices=None):
-        self.credentials = {
-            "user_id": user_id,
-            "token": token,
-            "region": region,
-            "unit": unit,
-            "custom_instruction": custom_instruction,
-            "device_type": int(device_type),
-            "allow_monster_moves": bool(allow_monster_moves),
-            "owned_accessories": owned_accessories or [],
-            "owned_devices": owned_devices or [],
-        }
-        self.region = region
-        self.device_type = int(device_type)
-        self.allow_monster_moves = bool(allow_monster_moves)
-        self.host = "euapi.speediance.com" if self.region == "EU" else "api2.speediance.com"
-        self.base_url = "https://" + self.host
-        self.library_cache_file = self._get_library_cache_file()
-        self.library_cache = self._load_library_cache()
-        with open(self.config_file, 'w') as f:
-            json.dump(self.credentials, f)
+        self.update_settings(
+            user_id=user_id,
+            token=token,
+            region=region,
+            unit=unit,
+            custom_instruction=custom_instruction,
+            device_type=device_type,
+            allow_monster_moves=allow_monster_moves,
+            owned_accessories=owned_accessories or [],
+            owned_devices=owned_devices or [],
+        )
 
     def update_unit(self, unit):
         """Updates the unit setting on the server (0=Metric, 1=Imperial)"""
@@ -119,17 +497,7 @@ class SpeedianceClient:
             resp = self._request('PUT', url, headers=self._get_headers(), json=payload)
             if resp.status_code == 200:
                 # Update local config
-                self.save_config(
-                    self.credentials.get("user_id"),
-                    self.credentials.get("token"),
-                    self.credentials.get("region"),
-                    unit,
-                    self.credentials.get("custom_instruction", ""),
-                    self.credentials.get("device_type", 1),
-                    self.credentials.get("allow_monster_moves", False),
-                    self.credentials.get("owned_accessories", []),
-                    self.credentials.get("owned_devices", []),
-                )
+                self.update_settings(unit=unit)
                 return True, "Unit updated successfully"
             else:
                 return False, f"Failed to update unit: {resp.text}"
@@ -180,17 +548,7 @@ class SpeedianceClient:
                 user_id = data.get('appUserId')
                 
                 if token and user_id:
-                    self.save_config(
-                        str(user_id),
-                        token,
-                        self.region,
-                        self.credentials.get('unit', 0),
-                        self.credentials.get('custom_instruction', ''),
-                        self.credentials.get('device_type', 1),
-                        self.credentials.get('allow_monster_moves', False),
-                        self.credentials.get('owned_accessories', []),
-                        self.credentials.get('owned_devices', []),
-                    )
+                    self.update_settings(user_id=user_id, token=token, region=self.region)
                     return True, "Login successful", None
                 return False, "Token or appUserId not found in response", f"Response: {resp.text}"
             else:
@@ -209,26 +567,18 @@ class SpeedianceClient:
             self._request('POST', url, headers=headers)
         except Exception as e:
             print(f"Logout error: {e}")
+        self.invalidate_response_cache()
         
         # Clear credentials but keep region/unit/instructions
-        self.save_config(
-            "",
-            "",
-            self.region,
-            self.credentials.get('unit', 0),
-            self.credentials.get('custom_instruction', ''),
-            self.credentials.get('device_type', 1),
-            self.credentials.get('allow_monster_moves', False),
-            self.credentials.get('owned_accessories', []),
-            self.credentials.get('owned_devices', []),
-        )
+        self.update_settings(user_id="", token="", region=self.region)
         return True
 
     def _get_headers(self):
+        creds = self.credentials
         return {
             "Host": self.host,
-            "App_user_id": self.credentials.get("user_id", ""),
-            "Token": self.credentials.get("token", ""),
+            "App_user_id": creds.get("user_id", ""),
+            "Token": creds.get("token", ""),
             "Timestamp": str(int(time.time() * 1000)),
             "Versioncode": "40304",
             "Mobiledevices": '{"brand":"google","device":"emulator64_x86_64_arm64","deviceType":"sdk_gphone64_x86_64","os":"","os_version":"31","manufacturer":"Google"}',
@@ -278,85 +628,194 @@ class SpeedianceClient:
     def get_library(self):
         if self.library_cache:
             return self.library_cache
-            
+        # Concurrent callers (several tabs opening /library) share one build
+        library, _ = self._inflight.do(("library", self.library_cache_file), self._build_library)
+        return library
+
+    def get_library_index(self, library=None, accessories=None):
+        """
+        Derived fields (equipment names, device tags, accessory bitmasks) of the current
+        library. Built once per library/accessory list and shared by all clients.
+        """
+        library = self.get_library() if library is None else library
+        accessories = self.get_accessories() if accessories is None else accessories
+        variant = self.library_variant
+        index = self._library_indexes.get(variant)
+        if index is None or not index.is_current(library, accessories):
+            index = self._library_indexes[variant] = LibraryIndex(library, accessories)
+        return index
+
+    def get_search_index(self, library_index=None):
+        """Full-text index of the current library; re-indexes only exercises that changed."""
+        library_index = library_index or self.get_library_index()
+        search = self._search_indexes.setdefault(self.library_variant, SearchIndex())
+        search.sync(library_index)
+        return search
+
+    def _build_library(self):
+        if self.library_cache:
+            return self.library_cache
+        try:
+            listing, _ = self._fetch_library_listing()
+
+            # 4. Fetch details in concurrent, adaptively sized batches
+            detailed_library = self.fetch_batch_details(list(listing.keys()))
+            for d in detailed_library:
+                if d['id'] in listing:
+                    self._attach_listing_info(d, listing[d['id']])
+
+            self.library_cache = detailed_library
+            self._save_library_cache(detailed_library)
+            return detailed_library
+
+        except Exception as e:
+            if str(e) == "Unauthorized": raise e
+            print(f"Error fetching library: {e}")
+        return []
+
+    def _fetch_library_listing(self):
+        """
+        Fetches the tab listings (steps 1-3 of a library build).
+        Returns (listing, complete): an ordered {group_id: basic_entry} dict deduplicated by id,
+        and whether every tab could be fetched.
+        """
         def fetch_categories(device_type):
             url = f"{self.base_url}/api/app/actionLibraryTab/list?deviceType={device_type}"
             resp = self._request('GET', url, headers=self._get_headers())
             return resp.json().get('data', [])
 
-        try:
+        def fetch_tab(job):
+            device_type, category = job
+            tab_id = category['id']
+            url = f"{self.base_url}/api/app/actionLibraryGroup/trainingPartGroup?tabId={tab_id}&deviceTypeList={device_type}"
+            actions = []
+            try:
+                resp = self._request('GET', url, headers=self._get_headers())
+                if resp.status_code != 200:
+                    return actions, False
+                data = resp.json().get('data', [])
+                for muscle_group in data:
+                    for action in muscle_group.get('actionLibraryGroupList', []):
+                        # Tag with category info and device source
+                        action['category_id'] = tab_id
+                        action['category_name'] = category['name']
+                        action['device_type'] = device_type
+                        actions.append(action)
+            except Exception as e:
+                print(f"Error fetching category {tab_id}: {e}")
+                return actions, False
+            return actions, True
+
+        with ThreadPoolExecutor(max_workers=LIBRARY_FETCH_WORKERS) as pool:
             # 1. Fetch all categories
             if self.device_type == 2 and self.allow_monster_moves:
+                cat_pal = pool.submit(contextvars.copy_context().run, fetch_categories, 2)
+                cat_monster = pool.submit(contextvars.copy_context().run, fetch_categories, 1)
                 categories_by_device = {
-                    2: fetch_categories(2),
-                    1: fetch_categories(1),
+                    2: cat_pal.result(),
+                    1: cat_monster.result(),
                 }
             else:
                 categories_by_device = {self.device_type: self.get_categories()}
 
+            # 2. Fetch exercises for each category concurrently.
+            # Results are collected in submission order, so the merge below stays deterministic.
+            futures = [
+                pool.submit(contextvars.copy_context().run, fetch_tab, (device_type, category))
+                for device_type, categories in categories_by_device.items()
+                for category in categories
+            ]
             all_basic_exercises = []
+            complete = all(categories_by_device.values())
+            for future in futures:
+                actions, ok = future.result()
+                all_basic_exercises.extend(actions)
+                complete = complete and ok
+
+        # 3. Deduplicate by ID (keep first occurrence)
+        unique_exercises = {}
+        for ex in all_basic_exercises:
+            if ex['id'] not in unique_exercises:
+                ex['device_type_list'] = [ex.get('device_type')]
+                unique_exercises[ex['id']] = ex
+            else:
+                existing = unique_exercises[ex['id']]
+                current = set(existing.get('device_type_list', [existing.get('device_type')]))
+                current.add(ex.get('device_type'))
+                existing['device_type_list'] = sorted(t for t in current if t)
+        return unique_exercises, complete
+
+    @staticmethod
+    def _attach_listing_info(detail, original):
+        """Copies category and device information from a listing entry onto a detailed entry."""
+        detail['category_id'] = original.get('category_id')
+        detail['category_name'] = original.get('category_name')
+        device_types = original.get('device_type_list', [original.get('device_type')])
+        detail['device_type_list'] = device_types
+        detail['device_type_tag'] = ",".join(str(t) for t in device_types if t)
+
+    @staticmethod
+    def _listing_changed(listing_entry, cached_entry):
+        """True if a version/update field present in both the listing and the cached details differs."""
+        for field in LIBRARY_CHANGE_FIELDS:
+            if field in listing_entry and field in cached_entry and listing_entry[field] != cached_entry[field]:
+                return True
+        return False
+
+    def sync_library(self):
+        """
+        Incremental library refresh. Re-reads the tab listings, fetches details only for
+        new or changed groups and prunes groups that disappeared upstream.
+        Returns a summary: {"added", "updated", "removed", "unchanged"} counts (lists of ids
+        for the first three) plus "full_build" when there was no cache to compare against.
+        """
+        if not self.library_cache:
+            library = self.get_library()
+            return {"added": [ex['id'] for ex in library], "updated": [], "removed": [],
+                    "unchanged": 0, "full_build": True}
+        summary, _ = self._inflight.do(("library_sync", self.library_cache_file), self._sync_library)
+        return summary
+
+    def _sync_library(self):
+        cached = self.library_cache or []
+        with self.bypass_cache():
+            listing, complete = self._fetch_library_listing()
+        cached_by_id = {ex['id']: ex for ex in cached}
+
+        added = [gid for gid in listing if gid not in cached_by_id]
+        updated = [gid for gid in listing if gid in cached_by_id and self._listing_changed(listing[gid], cached_by_id[gid])]
+        fetched = {d['id']: d for d in self.fetch_batch_details(added + updated)}
+
+        library = []
+        retagged = False
+        for gid, entry in listing.items():
+            detail = fetched.get(gid) or cached_by_id.get(gid)
+            if detail is None:
+                continue  # new group whose details could not be fetched
+            before = (detail.get('category_id'), detail.get('category_name'), detail.get('device_type_tag'))
+            self._attach_listing_info(detail, entry)
+            retagged = retagged or before != (detail['category_id'], detail['category_name'], detail['device_type_tag'])
+            library.append(detail)
+
+        removed = [gid for gid in cached_by_id if gid not in listing]
+        if not complete:
+            # A tab failed to load; keep its groups rather than pruning them by mistake
+            library.extend(cached_by_id[gid] for gid in removed)
+            removed = []
+
+        # Detail entries are per account; drop every account's copy
+        self.detail_cache.invalidate_prefixes(f"{int(gid)}." for gid in updated + removed)
+        for gid in updated + removed:
+            self._group_meta.pop(int(gid), None)
+
+        added = [gid for gid in added if gid in fetched]
+        updated = [gid for gid in updated if gid in fetched]
+        if added or updated or removed or retagged or len(library) != len(cached):
+            self.library_cache = library
+            self._save_library_cache(library, changed_ids=added + updated, removed_ids=removed)
+        return {"added": added, "updated": updated, "removed": removed,
+                "unchanged": len(library) - len(added) - len(updated), "full_build": False}
 
-            # 2. Fetch exercises for each category
-            for device_type, categories in categories_by_device.items():
-                for category in categories:
-                    tab_id = category['id']
-                    url = f"{self.base_url}/api/app/actionLibraryGroup/trainingPartGroup?tabId={tab_id}&deviceTypeList={device_type}"
-                    try:
-                        resp = self._request('GET', url, headers=self._get_headers())
-                        if resp.status_code == 200:
-                            data = resp.json().get('data', [])
-                            for muscle_group in data:
-                                for action in muscle_group.get('actionLibraryGroupList', []):
-                                    # Tag with category info and device source
-                                    action['category_id'] = tab_id
-                                    action['category_name'] = category['name']
-                                    action['device_type'] = device_type
-                                    all_basic_exercises.append(action)
-                    except Exception as e:
-                        print(f"Error fetching category {tab_id}: {e}")
-
-            # 3. Deduplicate by ID (keep first occurrence)
-            unique_exercises = {}
-            for ex in all_basic_exercises:
-                if ex['id'] not in unique_exercises:
-                    ex['device_type_list'] = [ex.get('device_type')]
-                    unique_exercises[ex['id']] = ex
-                else:
-                    existing = unique_exercises[ex['id']]
-                    current = set(existing.get('device_type_list', [existing.get('device_type')]))
-                    current.add(ex.get('device_type'))
-                    existing['device_type_list'] = sorted(t for t in current if t)
-            
-            all_ids = list(unique_exercises.keys())
-            detailed_library = []
-            chunk_size = 50
-            
-            # 4. Fetch details in batches
-            for i in range(0, len(all_ids), chunk_size):
-                chunk_ids = all_ids[i:i + chunk_size]
-                details = self.get_batch_details(chunk_ids)
-                
-                # Re-attach category info
-                for d in details:
-                    if d['id'] in unique_exercises:
-                        original = unique_exercises[d['id']]
-                        d['category_id'] = original.get('category_id')
-                        d['category_name'] = original.get('category_name')
-                        device_types = original.get('device_type_list', [original.get('device_type')])
-                        d['device_type_list'] = device_types
-                        d['device_type_tag'] = ",".join(str(t) for t in device_types if t)
-                
-                detailed_library.extend(details)
-            
-            self.library_cache = detailed_library
-            self._save_library_cache(detailed_library)
-            return detailed_library
-
-        except Exception as e:
-            if str(e) == "Unauthorized": raise e
-            print(f"Error fetching library: {e}")
-        return []
-    
     def get_accessories(self):
         url = f"{self.base_url}/api/app/accessories/list"
         try:
@@ -390,30 +849,193 @@ class SpeedianceClient:
         url = f"{self.base_url}/api/app/customTrainingTemplate?ids={template_id}"
         self._request('DELETE', url, headers=self._get_headers())
 
-    def get_exercise_detail(self, exercise_id):
+    def _detail_key(self, exercise_id):
+        """
+        Detail responses carry per-user fields (recommendedWeight), so the shared cache
+        keeps one entry per exercise and account: "<exercise id>.<account hash>".
+        """
+        user = self.credentials.get("user_id", "")
+        return f"{int(exercise_id)}.{hashlib.sha256(str(user).encode()).hexdigest()[:12]}"
+
+    def get_exercise_detail(self, exercise_id, refresh=False):
+        """Returns exercise group details, served from the detail cache unless refresh is set."""
+        key = self._detail_key(exercise_id)
+        if not refresh:
+            cached = self.detail_cache.get(key)
+            if cached is not None:
+                return copy.deepcopy(cached)
+
         url = f"{self.base_url}/api/app/actionLibraryGroup/{exercise_id}?isDisplay=1"
         resp = self._request('GET', url, headers=self._get_headers())
-        return resp.json().get('data', {})
+        data = resp.json().get('data', {})
+        if data:
+            self.detail_cache.set(key, data)
+            data = copy.deepcopy(data)
+        return data
+
+    def concurrency_stats(self):
+        """Adaptive concurrency limit plus request coalescing counters."""
+        return {"governor": self.governor.snapshot(), "single_flight": self._inflight.stats()}
+
+    def cache_stats(self):
+        """Hit/miss counters for the client-side caches."""
+        return {
+            "exercise_detail": self.detail_cache.stats(),
+            "responses": self.response_cache.stats(),
+        }
 
     def is_exercise_unilateral(self, group_id):
         detail = self.get_exercise_detail(group_id)
         return detail.get('isLeftRight') == 1
 
+    def _batch_details_url(self, group_ids):
+        query_str = "&".join(f"ids={gid}" for gid in group_ids)
+        return f"{self.base_url}/api/app/actionLibraryGroup/list?{query_str}"
+
+    def _request_batch_details(self, group_ids):
+        """Single list request that raises on any failure instead of returning []."""
+        resp = self._request('GET', self._batch_details_url(group_ids), headers=self._get_headers())
+        if resp.status_code != 200:
+            raise UpstreamStatusError(resp.status_code)
+        data = resp.json().get('data')
+        if not isinstance(data, list):
+            raise Exception("Unexpected batch response")
+        self._index_group_meta(data)
+        return data
+
+    def _index_group_meta(self, groups):
+        """Records default variant id and isLeftRight for each group in a batch/library response."""
+        for group in groups or []:
+            gid = group.get('id')
+            if gid is None:
+                continue
+            meta = self._group_meta.setdefault(int(gid), {})
+            variants = group.get('actionLibraryList') or []
+            if variants and variants[0].get('id'):
+                meta['variant_id'] = variants[0]['id']
+            if 'isLeftRight' in group:
+                meta['is_unilateral'] = group.get('isLeftRight') == 1
+
+    def resolve_group_meta(self, group_ids):
+        """
+        Returns {group_id: {"variant_id": ..., "is_unilateral": ...}} for the given groups.
+        Answers from the library cache and earlier batch responses; groups that are not
+        known yet are fetched together in a single batch request, and the details of the
+        groups it has no isLeftRight for in one concurrent wave.
+        """
+        library = self._loaded_library()
+        if library and self._group_meta_library is not library:
+            self._index_group_meta(library)
+            self._group_meta_library = library
+
+        group_ids = [int(gid) for gid in dict.fromkeys(group_ids)]
+        missing = [
+            gid for gid in group_ids
+            if 'variant_id' not in self._group_meta.get(gid, {}) or 'is_unilateral' not in self._group_meta.get(gid, {})
+        ]
+        if missing and not library:
+            # Library not in memory: read just these rows from the store
+            self._index_group_meta(self.library_store.get_many(self.library_variant, missing))
+            missing = [gid for gid in missing if 'is_unilateral' not in self._group_meta.get(gid, {})]
+        if missing:
+            self._index_group_meta(self.get_batch_details(missing))
+
+        # List responses carry no isLeftRight; ask the detail endpoint for the rest, all at
+        # once (the governor still bounds how many requests run)
+        lacking = [gid for gid in group_ids if 'is_unilateral' not in self._group_meta.get(gid, {})]
+        flags = self.gather(*((self.is_exercise_unilateral, gid) for gid in lacking))
+        for gid, is_unilateral in zip(lacking, flags):
+            self._group_meta.setdefault(gid, {})['is_unilateral'] = is_unilateral
+
+        return {gid: dict(self._group_meta.setdefault(gid, {})) for gid in group_ids}
+
     def get_batch_details(self, group_ids):
         if not group_ids:
             return []
-        query_parts = [f"ids={gid}" for gid in group_ids]
-        query_str = "&".join(query_parts)
-        url = f"{self.base_url}/api/app/actionLibraryGroup/list?{query_str}"
-        
         try:
-            resp = self._request('GET', url, headers=self._get_headers())
-            return resp.json().get('data', [])
+            return self._request_batch_details(group_ids)
         except Exception as e:
             if str(e) == "Unauthorized": raise e
             print(f"Error fetching batch details: {e}")
             return []
 
+    def _next_detail_chunk(self, ids, start):
+        """Takes up to detail_chunk_size ids from start while the URL stays under MAX_URL_LENGTH."""
+        length = len(self._batch_details_url([]))
+        end = start
+        while end < len(ids) and end - start < self.detail_chunk_size:
+            length += len(f"ids={ids[end]}&")
+            if length > MAX_URL_LENGTH and end > start:
+                break
+            end += 1
+        return ids[start:end]
+
+    def _tune_detail_chunk_size(self, latencies):
+        """Grows the chunk size while chunks are fast and halves it when they get slow."""
+        slowest = max(latencies)
+        size = self.detail_chunk_size
+        if slowest > DETAIL_TARGET_LATENCY:
+            size = size // 2
+        elif slowest < DETAIL_TARGET_LATENCY / 2:
+            size = int(size * 1.5)
+        self.detail_chunk_size = max(DETAIL_CHUNK_MIN, min(DETAIL_CHUNK_MAX, size))
+
+    def fetch_batch_details(self, group_ids):
+        """
+        Fetches details for many groups by issuing list requests concurrently.
+        Failed chunks are split in half and retried (within DETAIL_SPLIT_MAX_DEPTH and
+        DETAIL_RETRY_BUDGET) to isolate bad ids; chunks that still fail, or fail
+        transiently, are skipped.
+        Returns the details in the order of group_ids.
+        """
+        ids = list(dict.fromkeys(group_ids))
+        by_id = {}
+        retry = []  # (chunk, split depth) to retry after a failure, already split
+        retry_budget = DETAIL_RETRY_BUDGET
+        position = 0
+
+        with ThreadPoolExecutor(max_workers=DETAIL_FETCH_WORKERS) as pool:
+            while retry or position < len(ids):
+                # Build one wave: retried halves first, then fresh chunks
+                wave = []
+                while retry and len(wave) < DETAIL_FETCH_WORKERS:
+                    wave.append(retry.pop(0))
+                while position < len(ids) and len(wave) < DETAIL_FETCH_WORKERS:
+                    chunk = self._next_detail_chunk(ids, position)
+                    position += len(chunk)
+                    wave.append((chunk, 0))
+
+                def timed_fetch(chunk):
+                    started = time.monotonic()
+                    details = self._request_batch_details(chunk)
+                    return details, time.monotonic() - started
+
+                futures = [(chunk, depth, pool.submit(contextvars.copy_context().run, timed_fetch, chunk))
+                           for chunk, depth in wave]
+                latencies = []
+                for chunk, depth, future in futures:
+                    try:
+                        details, elapsed = future.result()
+                    except Exception as e:
+                        if str(e) == "Unauthorized": raise e
+                        if (len(chunk) > 1 and depth < DETAIL_SPLIT_MAX_DEPTH and retry_budget >= 2
+                                and not _is_transient(e)):
+                            retry_budget -= 2
+                            mid = len(chunk) // 2
+                            print(f"Batch of {len(chunk)} details failed ({e}); retrying as two halves")
+                            retry.extend([(chunk[:mid], depth + 1), (chunk[mid:], depth + 1)])
+                        else:
+                            print(f"Error fetching details for {len(chunk)} group(s) starting at {chunk[0]}: {e}")
+                        continue
+                    latencies.append(elapsed)
+                    for d in details:
+                        by_id.setdefault(d.get('id'), d)
+
+                if latencies:
+                    self._tune_detail_chunk_size(latencies)
+
+        return [by_id[gid] for gid in ids if gid in by_id]
+
     def get_calendar_month(self, date_str):
         """
         Fetches calendar data for a specific month.
@@ -466,12 +1088,6 @@ class SpeedianceClient:
         }
         try:
             resp = self._request('POST', url, headers=self._get_headers(), json=payload)
-            self.last_debug_info = {
-                "url": url, "method": "POST",
-                "request_body": payload,
-                "response_body": resp.json() if resp.content else None,
-                "status": resp.status_code,
-            }
             if resp.status_code == 401:
                 raise Exception("Unauthorized")
             return resp.json().get('data', False)
@@ -486,30 +1102,21 @@ class SpeedianceClient:
         Behebt den 'Parameter Error' durch saubere Trennung von weights und counterweight2.
         """
         
-        group_ids = list(set([ex['groupId'] for ex in exercises]))
-        details = self.get_batch_details(group_ids)
-        
-        id_map = {}
-        for d in details:
-            if d.get('actionLibraryList'):
-                id_map[str(d['id'])] = d['actionLibraryList'][0]['id']
-        
+        group_meta = self.resolve_group_meta([ex['groupId'] for ex in exercises])
+
         action_library_list = []
         total_capacity = 0
 
-        unilateral_check = {}
-        for group_id in group_ids:
-            unilateral_check[group_id] = self.is_exercise_unilateral(group_id)
-
         for ex in exercises:
             group_id = int(ex['groupId'])
             sets = ex['sets']
             preset_id = int(ex.get('preset_id', -1))
             
-            is_unilateral = unilateral_check.get(group_id, False)
+            meta = group_meta.get(group_id, {})
+            is_unilateral = meta.get('is_unilateral', False)
 
             user_variant_id = ex.get('variant_id')
-            real_variant_id = int(user_variant_id) if user_variant_id and str(user_variant_id).isdigit() else id_map.get(str(ex['groupId']))
+            real_variant_id = int(user_variant_id) if user_variant_id and str(user_variant_id).isdigit() else meta.get('variant_id')
             
             if not real_variant_id:
                 continue
@@ -764,3 +1371,4 @@ class SpeedianceClient:
             if str(e) == "Unauthorized": raise e
             print(f"Error fetching program detail: {e}")
             return {}
+
@@ -1,17 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, Response
-from api_client import SpeedianceClient
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, send_file, Response, g, session, has_request_context
+from werkzeug.local import LocalProxy
+from api_client import SpeedianceClient, SharedResources, CACHE_BYPASS_HEADER
+from client_pool import ClientPool
+from media_cache import MediaCacheIndex, MediaDownloader
+from journal import journal_context
+from library_index import PAYLOAD_FIELDS, query_library
+from delivery import AssetManifest, PrecompressedPayload, available_encodings, compress, content_hash, negotiate
+from contextlib import ExitStack
 import json
+import mimetypes
 import os
+import re
 import sys
+import uuid
 import webbrowser
-from threading import Timer, Thread
-import requests
-try:
-    import tkinter as tk
-    from tkinter import scrolledtext
-except Exception:
-    tk = None
-    scrolledtext = None
+from threading import Timer, Thread, Lock
+from jinja2 import FileSystemBytecodeCache
 from urllib.parse import urlparse
 
 # Determine if running as a script or frozen exe (PyInstaller)
@@ -25,8 +29,57 @@ else:
     # If running as script, use default paths
     app = Flask(__name__)
 
-app.secret_key = "speediance_secret_key" # For Flash Messages
-client = SpeedianceClient()
+# Signs the session cookie (flash messages, and the account key in multi-account mode)
+DEFAULT_SECRET_KEY = "speediance_secret_key"
+app.secret_key = os.environ.get("SPEEDIANCE_SECRET_KEY") or DEFAULT_SECRET_KEY
+
+# --- Accounts ---
+# By default every browser shares the account in config.json. With
+# SPEEDIANCE_MULTI_ACCOUNT=1 each browser session gets its own account, stored in
+# accounts/<key>.json. Clients are pooled and evicted when idle; library, exercise
+# details and cached reference data are shared by all of them.
+MULTI_ACCOUNT = os.environ.get("SPEEDIANCE_MULTI_ACCOUNT") == "1"
+ACCOUNTS_DIR = "accounts"
+DEFAULT_ACCOUNT = "default"
+CLIENT_IDLE_TTL = int(os.environ.get("SPEEDIANCE_CLIENT_IDLE_TTL", 1800))
+MAX_CLIENTS = int(os.environ.get("SPEEDIANCE_MAX_CLIENTS", 64))
+# Account keys are uuid4().hex; anything else in the cookie is rejected
+ACCOUNT_KEY_RE = re.compile(r"^[0-9a-f]{32}$")
+
+if MULTI_ACCOUNT and app.secret_key == DEFAULT_SECRET_KEY:
+    # The default key is public, so anyone could forge a session for another account
+    raise RuntimeError("SPEEDIANCE_MULTI_ACCOUNT=1 requires SPEEDIANCE_SECRET_KEY to be set to a private value")
+
+shared_resources = SharedResources()
+
+def _create_client(account):
+    if account == DEFAULT_ACCOUNT:
+        return SpeedianceClient(shared=shared_resources)
+    if not ACCOUNT_KEY_RE.match(account):
+        raise ValueError("Invalid account key")
+    os.makedirs(ACCOUNTS_DIR, exist_ok=True)
+    return SpeedianceClient(os.path.join(ACCOUNTS_DIR, f"{account}.json"), shared=shared_resources)
+
+clients = ClientPool(_create_client, idle_ttl=CLIENT_IDLE_TTL, max_clients=MAX_CLIENTS)
+
+def _account_key():
+    if not MULTI_ACCOUNT:
+        return DEFAULT_ACCOUNT
+    account = session.get('account')
+    if not isinstance(account, str) or not ACCOUNT_KEY_RE.match(account):
+        account = session['account'] = uuid.uuid4().hex
+        session.permanent = True
+    return account
+
+def _current_client():
+    """The client of the account behind the current request (the default account outside requests)."""
+    if not has_request_context():
+        return clients.get(DEFAULT_ACCOUNT)
+    if 'client' not in g:
+        g.client = clients.get(_account_key())
+    return g.client
+
+client = LocalProxy(_current_client)
 
 # --- Media Caching Logic ---
 # Define local cache path
@@ -40,6 +93,60 @@ else:
     
 CACHE_ROOT = os.path.join(current_dir, 'static', 'media_cache')
 
+# Compiled templates are kept between runs so the first page render skips Jinja compilation
+# (attached by start_background_work(), so importing the app creates no directories)
+JINJA_CACHE_DIR = os.path.join(current_dir, 'jinja_cache')
+
+# Static assets are served under content-hashed names; the manifest and the .gz/.br
+# siblings are built in the background at startup, plain /static URLs are used until then
+static_assets = AssetManifest(app.static_folder)
+# Fingerprinted URLs never change content, so browsers may keep them for a year
+IMMUTABLE_MAX_AGE = 31536000
+
+@app.template_global()
+def asset_url(filename):
+    """Fingerprinted URL of a static asset (plain /static URL for files added after startup)."""
+    fingerprinted = static_assets.url_path(filename)
+    if fingerprinted is None:
+        return url_for('static', filename=filename)
+    return url_for('asset', filename=fingerprinted)
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Serves a fingerprinted static asset, precompressed when the client accepts it."""
+    resolved = static_assets.resolve(filename)
+    if resolved is None:
+        return "Unknown asset", 404
+    rel_path, version, siblings = resolved
+    encoding = negotiate(request.headers.get('Accept-Encoding'), siblings)
+    path = siblings[encoding] if encoding else os.path.join(app.static_folder, rel_path)
+    response = send_file(
+        path,
+        mimetype=mimetypes.guess_type(rel_path)[0] or 'application/octet-stream',
+        download_name=os.path.basename(rel_path),
+        etag=version + (f"-{encoding}" if encoding else ""),
+        max_age=IMMUTABLE_MAX_AGE,
+        conditional=True,
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if siblings:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+MEDIA_DOWNLOAD_TIMEOUT = 10
+
+def _media_downloaded(url, path):
+    media_index.add(path)
+    print(f"[DOWNLOAD] Saved {os.path.basename(path)} ({os.path.getsize(path)/1024:.2f} KB) to cache.")
+
+# Single download per URL, shared by /media_proxy and the preload job
+media_downloads = MediaDownloader(timeout=MEDIA_DOWNLOAD_TIMEOUT, on_complete=_media_downloaded)
+# Which files are cached, for local_cache_filter: loaded by one background walk at startup
+# (which also clears partial downloads left by a crash), then updated on download
+media_index = MediaCacheIndex()
+
 def get_cache_path(url):
     """Determines local path and subfolder based on URL extension."""
     parsed = urlparse(url)
@@ -58,14 +165,80 @@ def get_cache_path(url):
     
     return os.path.join(CACHE_ROOT, subfolder, filename), subfolder
 
+@app.before_request
+def tag_upstream_journal():
+    """Tags upstream calls made while handling this request so /debug/last_response can filter by it."""
+    g.request_id = uuid.uuid4().hex[:12]
+    g.journal_token = journal_context.set(g.request_id)
+
+@app.after_request
+def expose_request_id(response):
+    if 'request_id' in g:
+        response.headers['X-Request-Id'] = g.request_id
+    return response
+
+# Bodies worth compressing; smaller ones are sent as they are
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/plain", "text/css", "text/javascript", "application/javascript"}
+MIN_COMPRESS_SIZE = 1024
+
+@app.after_request
+def compress_and_validate(response):
+    """
+    Adds a strong ETag to buffered JSON/HTML/text responses, answers If-None-Match with
+    304 and compresses the body (br/gzip) when the client accepts it. Streamed, file and
+    already encoded responses (media, static files, precompressed payloads) pass through.
+    """
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers or 'ETag' in response.headers):
+        return response
+    data = response.get_data()
+    encoding = None
+    if len(data) >= MIN_COMPRESS_SIZE:
+        encoding = negotiate(request.headers.get('Accept-Encoding'), available_encodings())
+        response.vary.add('Accept-Encoding')
+
+    if request.method in ('GET', 'HEAD'):
+        # Each encoding is its own representation, so it gets its own strong ETag
+        etag = content_hash(data) + (f"-{encoding}" if encoding else "")
+        response.set_etag(etag)
+        if 'Cache-Control' not in response.headers:
+            response.headers['Cache-Control'] = 'private, no-cache'
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+            response.set_data(b"")
+            response.headers.pop('Content-Length', None)
+            return response
+
+    if encoding:
+        response.set_data(compress(data, encoding, fast=True))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.before_request
+def honor_cache_bypass():
+    """A hard reload (Cache-Control: no-cache) or an X-Cache-Bypass header refreshes cached upstream data."""
+    if request.headers.get(CACHE_BYPASS_HEADER) or 'no-cache' in request.headers.get('Cache-Control', ''):
+        g.cache_bypass = ExitStack()
+        g.cache_bypass.enter_context(client.bypass_cache())
+
+@app.teardown_request
+def end_request_context(exc):
+    stack = g.pop('cache_bypass', None)
+    if stack:
+        stack.close()
+    token = g.pop('journal_token', None)
+    if token:
+        journal_context.reset(token)
+
 @app.template_filter('local_cache')
 def local_cache_filter(url, force=False):
     """Jinja filter to rewrite remote URLs to local proxy URLs."""
     if not url: return ""
     
-    # Check if file exists locally
+    # Check if file exists locally (in-memory index, no filesystem call)
     local_path, _ = get_cache_path(url)
-    if local_path and os.path.exists(local_path):
+    if local_path and local_path in media_index:
         return url_for('media_proxy', url=url)
     
     # If forced (e.g. on detail page), use proxy to trigger download
@@ -75,6 +248,22 @@ def local_cache_filter(url, force=False):
     # If not cached and not forced, return original URL to let browser fetch directly
     return url
 
+# CDN media files never change under the same name
+MEDIA_MAX_AGE = 30 * 24 * 3600
+
+def _send_cached_media(local_path):
+    """
+    Serves a cached media file with byte ranges (206, If-Range), ETag/Last-Modified
+    revalidation (304) and a long Cache-Control, so video seeking and repeat views
+    don't transfer the whole file again.
+    """
+    return send_from_directory(
+        os.path.dirname(local_path),
+        os.path.basename(local_path),
+        max_age=MEDIA_MAX_AGE,
+        conditional=True,
+    )
+
 @app.route('/media_proxy')
 def media_proxy():
     """Downloads and serves media files locally."""
@@ -90,33 +279,43 @@ def media_proxy():
 
     # Serve from cache if exists
     if os.path.exists(local_path):
+        media_index.add(local_path)
         size = os.path.getsize(local_path)
         print(f"[CACHE HIT] Served {filename} from disk. Saved {size/1024:.2f} KB of CDN traffic.")
-        return send_from_directory(os.path.dirname(local_path), filename)
-
-    # Download if missing
-    try:
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
-        
-        # Stream download
-        print(f"[CACHE MISS] Downloading {filename} from CDN...")
-        resp = requests.get(remote_url, stream=True, timeout=10)
-        if resp.status_code == 200:
-            with open(local_path, 'wb') as f:
-                for chunk in resp.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            
-            size = os.path.getsize(local_path)
-            print(f"[DOWNLOAD] Saved {filename} ({size/1024:.2f} KB) to cache.")
-            return send_from_directory(os.path.dirname(local_path), filename)
-        else:
-            # If download fails, redirect to original URL
-            print(f"[ERROR] Failed to download {remote_url} (Status {resp.status_code})")
-            return redirect(remote_url)
-    except Exception as e:
-        print(f"[ERROR] Cache download failed for {remote_url}: {e}")
+        return _send_cached_media(local_path)
+
+    # Download if missing: the browser gets the bytes while they are written to the cache
+    media_index.discard(local_path)
+    download = media_downloads.start(remote_url, local_path)
+    if download is None:
+        # Another request finished it in the meantime
+        return _send_cached_media(local_path)
+    print(f"[CACHE MISS] Streaming {filename} from CDN while caching it...")
+    if not download.wait_for_headers(MEDIA_DOWNLOAD_TIMEOUT) or download.status != 200:
+        # If download fails, redirect to original URL
+        print(f"[ERROR] Failed to download {remote_url} ({download.error or download.status})")
         return redirect(remote_url)
+    mimetype = download.content_type or mimetypes.guess_type(filename)[0]
+    length = int(download.content_length) if str(download.content_length or '').isdigit() else None
+    if length is None:
+        # Without the total size a range can't be answered; tell the player not to ask
+        response = Response(download.stream(), mimetype=mimetype)
+        response.headers['Accept-Ranges'] = 'none'
+    else:
+        # A seek during the first play gets its range as soon as the download reaches it.
+        # If-Range refers to a representation this response doesn't have, so it gets 200.
+        byte_range = None
+        if request.range and 'If-Range' not in request.headers:
+            byte_range = request.range.range_for_length(length)
+        start, stop = byte_range or (0, length)
+        response = Response(download.stream(start, stop), status=206 if byte_range else 200, mimetype=mimetype)
+        response.headers['Content-Length'] = str(stop - start)
+        response.headers['Accept-Ranges'] = 'bytes'
+        if byte_range:
+            response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{length}"
+    # The next view revalidates and gets the cached file
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/')
 def index():
@@ -140,28 +339,19 @@ def index():
 def settings():
     if request.method == 'POST':
         # Manual config save
-        device_type = int(request.form.get('device_type', client.credentials.get('device_type', 1)))
-        allow_monster_moves = bool(request.form.get('allow_monster_moves'))
-        client.save_config(
-            request.form['user_id'],
-            request.form['token'],
-            request.form.get('region', 'Global'),
-            int(request.form.get('unit', 0)),
-            request.form.get('custom_instruction', ''),
-            device_type,
-            allow_monster_moves,
-            client.credentials.get('owned_accessories', []),
-            client.credentials.get('owned_devices', []),
+        client.update_settings(
+            user_id=request.form['user_id'],
+            token=request.form['token'],
+            region=request.form.get('region', 'Global'),
+            unit=int(request.form.get('unit', 0)),
+            custom_instruction=request.form.get('custom_instruction', ''),
+            device_type=int(request.form.get('device_type', client.credentials.get('device_type', 1))),
+            allow_monster_moves=bool(request.form.get('allow_monster_moves')),
         )
         flash("Settings saved!", "success")
         return redirect(url_for('index'))
     
-    creds = client.load_config()
-    # Ensure new fields exist for older configs
-    if 'owned_accessories' not in creds:
-        creds['owned_accessories'] = []
-    if 'owned_devices' not in creds:
-        creds['owned_devices'] = []
+    creds = client.credentials
     accessories = []
     if creds.get('token'):
         try:
@@ -176,18 +366,7 @@ def update_custom_instruction():
     instruction = data.get('instruction', '')
     
     # Update only the instruction, keep other settings
-    creds = client.credentials
-    client.save_config(
-        creds.get('user_id'),
-        creds.get('token'),
-        creds.get('region'),
-        creds.get('unit', 0),
-        instruction,
-        creds.get('device_type', 1),
-        creds.get('allow_monster_moves', False),
-        creds.get('owned_accessories', []),
-        creds.get('owned_devices', []),
-    )
+    client.update_settings(custom_instruction=instruction)
     return jsonify({"status": "success"})
 
 @app.route('/settings/unit', methods=['POST'])
@@ -204,18 +383,7 @@ def update_unit():
 def update_accessories():
     selected = request.form.getlist('accessories')
     owned = [int(x) for x in selected]
-    creds = client.credentials
-    client.save_config(
-        creds.get('user_id'),
-        creds.get('token'),
-        creds.get('region'),
-        creds.get('unit', 0),
-        creds.get('custom_instruction', ''),
-        creds.get('device_type', 1),
-        creds.get('allow_monster_moves', False),
-        owned,
-        creds.get('owned_devices', []),
-    )
+    client.update_settings(owned_accessories=owned)
     flash("Accessory settings updated!", "success")
     return redirect(url_for('settings'))
 
@@ -223,18 +391,7 @@ def update_accessories():
 def update_owned_devices():
     selected = request.form.getlist('owned_devices')
     owned = [int(x) for x in selected]
-    creds = client.credentials
-    client.save_config(
-        creds.get('user_id'),
-        creds.get('token'),
-        creds.get('region'),
-        creds.get('unit', 0),
-        creds.get('custom_instruction', ''),
-        creds.get('device_type', 1),
-        creds.get('allow_monster_moves', False),
-        creds.get('owned_accessories', []),
-        owned,
-    )
+    client.update_settings(owned_devices=owned)
     flash("Owned devices updated!", "success")
     return redirect(url_for('settings'))
 
@@ -248,10 +405,8 @@ def login():
         flash("Email and password required", "error")
         return redirect(url_for('settings'))
     
-    # Update client region before login attempt
-    client.region = region
-    client.host = "euapi.speediance.com" if region == "EU" else "api2.speediance.com"
-    client.base_url = "https://" + client.host
+    # Update client region before login attempt (rebuilds the connection pool on a host switch)
+    client.set_region(region)
         
     success, message, debug_info = client.login(email, password)
     if success:
@@ -273,6 +428,8 @@ def logout():
 def preload_assets():
     """Streamed response that downloads all assets."""
     if not client.credentials.get("token"): return "Unauthorized", 401
+    # The generator outlives the request context, so keep the account's client itself
+    account_client = client._get_current_object()
 
     def download_url(url):
         if not url or not url.startswith('http'): return "Skipped (Invalid URL)"
@@ -280,21 +437,16 @@ def preload_assets():
         local_path, subfolder = get_cache_path(url)
         if not local_path: return "Skipped (Path error)"
         
-        if os.path.exists(local_path) and os.path.getsize(local_path) > 0:
+        if local_path in media_index:
             return "Skipped (Already exists)"
             
-        try:
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            resp = requests.get(url, stream=True, timeout=20)
-            if resp.status_code == 200:
-                with open(local_path, 'wb') as f:
-                    for chunk in resp.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                return "Downloaded"
-            else:
-                return f"Failed (Status {resp.status_code})"
-        except Exception as e:
-            return f"Error: {e}"
+        result = media_downloads.fetch(url, local_path)
+        if result == "cached":
+            media_index.add(local_path)
+            return "Skipped (Already exists)"
+        if result == "downloaded":
+            return "Downloaded"
+        return result.capitalize()
 
     def extract_urls_from_exercise(ex):
         urls = set()
@@ -339,7 +491,7 @@ def preload_assets():
         # 1. Accessories
         yield "--- Processing Accessories ---\n"
         try:
-            accessories = client.get_accessories()
+            accessories = account_client.get_accessories()
             for acc in accessories:
                 if acc.get('img'): 
                     res = download_url(acc['img'])
@@ -351,7 +503,7 @@ def preload_assets():
         yield "\n--- Processing Exercise Library ---\n"
         try:
             # Get the list of groups first
-            library_groups = client.get_library()
+            library_groups = account_client.get_library()
             total_groups = len(library_groups)
             
             for i, group in enumerate(library_groups):
@@ -362,7 +514,7 @@ def preload_assets():
                 # Fetch FULL details for this exercise group
                 # This ensures we get all variants and videos even if the list endpoint was incomplete
                 try:
-                    detail = client.get_exercise_detail(group_id)
+                    detail = account_client.get_exercise_detail(group_id)
                     if not detail:
                         yield "Failed to fetch details.\n"
                         continue
@@ -403,9 +555,14 @@ def api_stats(group_id):
 def library():
     if not client.credentials.get("token"): return redirect(url_for('settings'))
     try:
-        exercises = client.get_library()
-        accessories = client.get_accessories()
-        categories = client.get_categories()
+        # The exercises themselves are loaded page by page from /api/library
+        exercises, accessories, categories = client.gather(
+            (client.get_library,),
+            (client.get_accessories,),
+            (client.get_categories,),
+        )
+        # Equipment names, device tags and accessory masks are computed once per library
+        client.get_library_index(exercises, accessories)
     except Exception as e:
         if str(e) == "Unauthorized":
             client.logout()
@@ -413,22 +570,13 @@ def library():
             return redirect(url_for('settings'))
         flash(f"Error loading library: {e}", "error")
         exercises = []
-        accessories = []
         categories = []
 
-    accessory_map = {str(acc['id']): acc['name'] for acc in accessories}
-    
-    # Enrich exercises with equipment names
-    for ex in exercises:
-        acc_ids = str(ex.get('accessories', '')).split(',')
-        names = [accessory_map.get(aid, 'Standard') for aid in acc_ids if aid]
-        ex['equipment_name'] = ', '.join(names) if names else 'Standard'
-        
     owned_accessories = client.credentials.get('owned_accessories', [])
     owned_devices = client.credentials.get('owned_devices', [])
     return render_template(
         'library.html',
-        exercises=exercises,
+        total=len(exercises),
         categories=categories,
         device_type=client.device_type,
         allow_monster_moves=client.allow_monster_moves,
@@ -439,16 +587,36 @@ def library():
 @app.route('/library/refresh')
 def refresh_library():
     if not client.credentials.get("token"): return redirect(url_for('settings'))
-    
-    # Clear memory and disk cache
-    client.library_cache = None
-    if os.path.exists(client.library_cache_file):
-        try:
-            os.remove(client.library_cache_file)
-        except Exception as e:
-            print(f"Error removing cache file: {e}")
-            
-    flash("Library cache cleared. Reloading from server...", "info")
+
+    client.invalidate_response_cache('categories')
+    client.invalidate_response_cache('accessories')
+
+    if request.args.get('full') == '1':
+        # Clear memory and disk cache; /library rebuilds everything
+        client.clear_library_cache()
+        flash("Library cache cleared. Reloading from server...", "info")
+        return redirect(url_for('library'))
+
+    try:
+        summary = client.sync_library()
+    except Exception as e:
+        if str(e) == "Unauthorized":
+            client.logout()
+            flash("Session expired. Please login again.", "error")
+            return redirect(url_for('settings'))
+        flash(f"Error refreshing library: {e}", "error")
+        return redirect(url_for('library'))
+
+    if summary["full_build"]:
+        flash(f"Library downloaded: {len(summary['added'])} exercises.", "success")
+    elif summary["added"] or summary["updated"] or summary["removed"]:
+        flash(
+            f"Library updated: {len(summary['added'])} added, {len(summary['updated'])} changed, "
+            f"{len(summary['removed'])} removed ({summary['unchanged']} unchanged).",
+            "success",
+        )
+    else:
+        flash(f"Library is up to date ({summary['unchanged']} exercises).", "info")
     return redirect(url_for('library'))
 
 @app.route('/exercise/<int:ex_id>')
@@ -481,6 +649,143 @@ def exercise_detail(ex_id):
 
     return render_template('exercise_detail.html', ex=detail, accessories=mapped_accessories)
 
+# Page size of /api/library (default and upper bound)
+LIBRARY_PAGE_SIZE = 60
+LIBRARY_PAGE_MAX = 500
+
+def _int_list(value):
+    """Parses "1,2,3" query parameters; None when nothing usable was given."""
+    ids = [int(v) for v in (value or '').split(',') if v.strip().isdigit()]
+    return ids or None
+
+@app.route('/api/library')
+def api_library():
+    """
+    Filtered, sorted, cursor-paginated slice of the library.
+    Query parameters: filter_ids, device_type, muscle, ids, q (full-text search, results
+    ordered by relevance unless sort is given), owned_accessories=1 (or accessories=<ids>),
+    owned_devices=1, sort (position|title|id|category|relevance, "-" for descending),
+    cursor, limit and fields (comma separated projection).
+    """
+    if not client.credentials.get("token"):
+        return jsonify({"error": "Unauthorized"}), 401
+    args = request.args
+    try:
+        index = client.get_library_index()
+        owned_accessories = client.credentials.get('owned_accessories', [])
+        owned_devices = client.credentials.get('owned_devices', [])
+        if 'accessories' in args:
+            owned_mask = index.mask(_int_list(args['accessories']) or [])
+        elif args.get('owned_accessories') == '1' and owned_accessories:
+            owned_mask = index.mask(owned_accessories)
+        else:
+            owned_mask = None
+        relevance = None
+        if args.get('q', '').strip():
+            ranked = client.get_search_index(index).search(args['q'])
+            relevance = {doc_id: rank for rank, (doc_id, _) in enumerate(ranked)}
+        result = query_library(
+            index,
+            category_ids=_int_list(args.get('filter_ids')),
+            device_type=args.get('device_type', type=int),
+            muscle=args.get('muscle', type=int),
+            ids=_int_list(args.get('ids')),
+            owned_mask=owned_mask,
+            owned_devices=owned_devices if args.get('owned_devices') == '1' else None,
+            relevance=relevance,
+            sort=args.get('sort', 'relevance' if relevance is not None else 'position'),
+            cursor=args.get('cursor'),
+            limit=max(1, min(args.get('limit', LIBRARY_PAGE_SIZE, type=int), LIBRARY_PAGE_MAX)),
+            fields=[f for f in args.get('fields', '').split(',') if f] or None,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        if str(e) == "Unauthorized":
+            return jsonify({"error": "Unauthorized"}), 401
+        return jsonify({"error": str(e)}), 500
+
+    for item in result["items"]:
+        if item.get('img'):
+            item['img'] = local_cache_filter(item['img'])
+    return jsonify(result)
+
+# variant -> (library list, PrecompressedPayload); rebuilt only when the library changes
+_library_payloads = {}
+_library_payloads_lock = Lock()
+
+def _library_payload():
+    """Serialized and precompressed library of the current client's variant."""
+    library = client.get_library()
+    variant = client.library_variant
+    with _library_payloads_lock:
+        entry = _library_payloads.get(variant)
+        if entry is None or entry[0] is not library:
+            items = [{f: ex[f] for f in PAYLOAD_FIELDS if f in ex} for ex in library]
+            body = json.dumps(items, separators=(",", ":")).encode()
+            entry = _library_payloads[variant] = (library, PrecompressedPayload(body))
+    return entry[1]
+
+def _send_payload(payload, max_age=IMMUTABLE_MAX_AGE):
+    """Serves a PrecompressedPayload with its ETag, answering 304 when the client has it."""
+    response = Response(mimetype=payload.mimetype)
+    response.set_etag(payload.version)
+    response.headers['Cache-Control'] = f'private, max-age={max_age}, immutable'
+    response.vary.add('Accept-Encoding')
+    if request.if_none_match.contains(payload.version):
+        response.status_code = 304
+        return response
+    encoding, data = payload.select(request.headers.get('Accept-Encoding'))
+    response.set_data(data)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.route('/api/library/v/<string:version>.json')
+def api_library_payload(version):
+    """The whole library (PAYLOAD_FIELDS) under a content-hashed, immutable URL."""
+    if not client.credentials.get("token"):
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        payload = _library_payload()
+    except Exception as e:
+        if str(e) == "Unauthorized":
+            return jsonify({"error": "Unauthorized"}), 401
+        return jsonify({"error": str(e)}), 500
+    if payload.version != version:
+        # Stale page: point it at the current version instead of caching the wrong body
+        response = redirect(url_for('api_library_payload', version=payload.version))
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return _send_payload(payload)
+
+@app.route('/api/library/search')
+def api_library_search():
+    """Ranked, typo-tolerant search over titles, categories, muscles and equipment (?q=, limit, fields)."""
+    if not client.credentials.get("token"):
+        return jsonify({"error": "Unauthorized"}), 401
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 20, type=int), LIBRARY_PAGE_MAX))
+    fields = [f for f in request.args.get('fields', '').split(',') if f] or None
+    try:
+        index = client.get_library_index()
+        ranked = client.get_search_index(index).search(query)
+    except Exception as e:
+        if str(e) == "Unauthorized":
+            return jsonify({"error": "Unauthorized"}), 401
+        return jsonify({"error": str(e)}), 500
+
+    top = ranked[:limit]
+    scores = dict(top)
+    relevance = {doc_id: rank for rank, (doc_id, _) in enumerate(top)}
+    result = query_library(index, relevance=relevance, sort='relevance', limit=limit, fields=fields)
+    for item in result["items"]:
+        if 'id' in item:
+            item['score'] = round(scores[item['id']], 3)
+        if item.get('img'):
+            item['img'] = local_cache_filter(item['img'])
+    return jsonify({"query": query, "items": result["items"], "total": len(ranked)})
+
 @app.route('/api/exercise/<int:ex_id>')
 def api_exercise_detail(ex_id):
     """Returns details as JSON for the frontend (dropdowns)"""
@@ -587,8 +892,10 @@ def api_history():
     if not start or not end:
         return jsonify({"error": "Missing start/end parameters"}), 400
     try:
-        records = client.get_training_records(start, end)
-        stats = client.get_training_stats(start, end)
+        records, stats = client.gather(
+            (client.get_training_records, start, end),
+            (client.get_training_stats, start, end),
+        )
         return jsonify({"records": records, "stats": stats})
     except Exception as e:
         if str(e) == "Unauthorized":
@@ -602,8 +909,10 @@ def api_history_detail(training_id):
         return jsonify({"error": "Unauthorized"}), 401
     training_type = request.args.get('type', 'custom')  # 'course' or 'custom'
     try:
-        detail = client.get_training_detail(training_id, training_type)
-        session_info = client.get_training_session_info(training_id)
+        detail, session_info = client.gather(
+            (client.get_training_detail, training_id, training_type),
+            (client.get_training_session_info, training_id),
+        )
         return jsonify({"detail": detail, "session": session_info})
     except Exception as e:
         if str(e) == "Unauthorized":
@@ -612,8 +921,34 @@ def api_history_detail(training_id):
 
 @app.route('/debug/last_response')
 def debug_last_response():
-    """Returns the last API request/response info for debugging."""
-    return jsonify(client.last_debug_info)
+    """
+    Returns the last API request/response info for debugging.
+    With any of the filters (request_id, method, status, url, errors, limit) it returns
+    {"entries": [...]} from the recent-request journal instead, newest first.
+    """
+    filters = ('request_id', 'method', 'status', 'url', 'errors', 'limit')
+    if not any(key in request.args for key in filters):
+        return jsonify(client.journal.latest())
+    entries = client.journal.entries(
+        limit=request.args.get('limit', 20, type=int),
+        request_id=request.args.get('request_id'),
+        method=request.args.get('method'),
+        status=request.args.get('status', type=int),
+        url_contains=request.args.get('url'),
+        errors_only=request.args.get('errors') == '1',
+    )
+    return jsonify({"entries": entries})
+
+@app.route('/debug/cache_stats')
+def debug_cache_stats():
+    """Returns hit/miss counters of the client-side caches."""
+    return jsonify(client.cache_stats())
+
+@app.route('/debug/concurrency')
+def debug_concurrency():
+    """Returns the adaptive upstream concurrency limit, throttle events and coalescing counters."""
+    return jsonify(dict(client.concurrency_stats(), client_pool=clients.stats(),
+                        media_downloads=media_downloads.stats(), media_cache={"files": len(media_index)}))
 
 @app.route('/browse')
 def browse_page():
@@ -689,10 +1024,12 @@ def edit(code):
     if not client.credentials.get("token"): return redirect(url_for('settings'))
     
     try:
-        # Load workout details via code
-        workout = client.get_workout_detail(code)
-        library = client.get_library()
-        categories = client.get_categories()
+        # Load workout details via code; the library itself is fetched by the page
+        workout, payload, categories = client.gather(
+            (client.get_workout_detail, code),
+            (_library_payload,),
+            (client.get_categories,),
+        )
     except Exception as e:
         if str(e) == "Unauthorized":
             client.logout()
@@ -709,7 +1046,7 @@ def edit(code):
     custom_instruction = client.credentials.get("custom_instruction", "")
     return render_template(
         'create.html',
-        library=library,
+        library_url=url_for('api_library_payload', version=payload.version),
         existing_workout=workout,
         unit=unit,
         custom_instruction=custom_instruction,
@@ -741,14 +1078,17 @@ def create():
             return jsonify({"status": "error", "message": str(e)})
 
     try:
-        library = client.get_library()
-        categories = client.get_categories()
+        payload, categories = client.gather(
+            (_library_payload,),
+            (client.get_categories,),
+        )
+        library_url = url_for('api_library_payload', version=payload.version)
     except Exception as e:
         if str(e) == "Unauthorized":
             client.logout()
             flash("Session expired. Please login again.", "error")
             return redirect(url_for('settings'))
-        library = []
+        library_url = None
         categories = []
 
     unit = client.credentials.get("unit", 0)
@@ -758,7 +1098,7 @@ def create():
     # This has NO influence on the edit route, which sends its own data.
     return render_template(
         'create.html',
-        library=library,
+        library_url=library_url,
         existing_workout=None,
         unit=unit,
         custom_instruction=custom_instruction,
@@ -773,6 +1113,9 @@ def delete(id):
     flash("Workout deleted.", "info")
     return redirect(url_for('index'))
 
+# Worker threads of the production server (packaged exe and `python app.py --serve`)
+SERVER_THREADS = int(os.environ.get("SPEEDIANCE_SERVER_THREADS", 8))
+
 class TextRedirector(object):
     def __init__(self, widget, tag="stdout"):
         self.widget = widget
@@ -791,16 +1134,44 @@ class TextRedirector(object):
         pass
 
 def open_browser():
+    if os.environ.get("SPEEDIANCE_NO_BROWSER"):
+        return
     webbrowser.open_new("http://127.0.0.1:5001")
 
+def start_background_work():
+    """
+    Startup work that touches the filesystem, kept out of module import (tests, WSGI
+    servers importing the app) and run once by the serving process.
+    """
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    static_assets.build_in_background()
+    media_index.load_in_background(CACHE_ROOT)
+
+def serve(threads=SERVER_THREADS):
+    """Runs the app on a multi-threaded production WSGI server (waitress when installed)."""
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        from werkzeug.serving import run_simple
+        print("waitress is not installed; using the threaded Werkzeug server.")
+        run_simple('0.0.0.0', 5001, app, threaded=True)
+        return
+    print(f"Serving on http://127.0.0.1:5001 with {threads} threads")
+    waitress_serve(app, host='0.0.0.0', port=5001, threads=threads)
+
 def run_flask_server():
     try:
-        app.run(debug=False, port=5001, host='0.0.0.0', use_reloader=False)
+        serve()
     except Exception as e:
         print(f"Error starting server: {e}")
 
 def start_gui():
-    if tk is None:
+    # Imported here so script/server starts do not pay for loading Tk
+    try:
+        import tkinter as tk
+        from tkinter import scrolledtext
+    except Exception:
         print("Tkinter is not available; starting Flask server without GUI.")
         run_flask_server()
         return
@@ -845,7 +1216,20 @@ def start_gui():
     root.mainloop()
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--serve', action='store_true', help="Run on the multi-threaded production server instead of the debug server")
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS)
+    args, _ = parser.parse_known_args()
+
+    client.warm_library_cache()
+    # The debug reloader runs this file in a watcher and a serving process; only the
+    # serving one (WERKZEUG_RUN_MAIN) starts the background work there
+    if getattr(sys, 'frozen', False) or args.serve or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_work()
     if getattr(sys, 'frozen', False):
         start_gui()
+    elif args.serve:
+        serve(args.threads)
     else:
         app.run(debug=True, port=5001, host='0.0.0.0')
@@ -0,0 +1,73 @@
+"""
+Measures time-to-first-response of the app: starts it, polls until the server answers
+and prints how long that took. Works for the script and for the PyInstaller build.
+
+    python benchmark_startup.py                      # python app.py
+    python benchmark_startup.py --exe dist/UnofficialSpeedianceWorkoutManager
+    python benchmark_startup.py --runs 5 --path /library
+"""
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+PORT = 5001
+
+
+def measure(command, path, timeout):
+    env = dict(os.environ, SPEEDIANCE_NO_BROWSER="1")
+    popen_kwargs = {"env": env, "stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+    if os.name == "nt":
+        popen_kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        # The debug reloader forks a child; a new session lets us stop both
+        popen_kwargs["start_new_session"] = True
+
+    started = time.perf_counter()
+    proc = subprocess.Popen(command, **popen_kwargs)
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{command[0]} exited with code {proc.returncode}")
+            try:
+                requests.get(f"http://127.0.0.1:{PORT}{path}", timeout=1, allow_redirects=False)
+                return time.perf_counter() - started
+            except requests.ConnectionError:
+                time.sleep(0.02)
+        raise RuntimeError(f"No response within {timeout}s")
+    finally:
+        if os.name == "nt":
+            proc.kill()
+        else:
+            os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exe", help="Path to a PyInstaller build (default: run app.py with this interpreter)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--path", default="/settings", help="Page to request")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    if args.exe:
+        command = [args.exe]
+    else:
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")]
+
+    timings = []
+    for run in range(1, args.runs + 1):
+        elapsed = measure(command, args.path, args.timeout)
+        timings.append(elapsed)
+        print(f"run {run}: {elapsed * 1000:.0f} ms")
+    print(f"median: {statistics.median(timings) * 1000:.0f} ms  best: {min(timings) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+Small caching helpers used by SpeedianceClient.
+
+LRUCache is the in-memory tier (size capped, per-entry TTL), DiskCache keeps one
+JSON file per key so entries survive restarts, and TieredCache combines the two.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries=512, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Stores a value and returns the (key, expires_at, value) entries evicted to make room."""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        evicted = []
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                old_key, (old_expires, old_value) = self._entries.popitem(last=False)
+                self.evictions += 1
+                evicted.append((old_key, old_expires, old_value))
+        return evicted
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def pop_prefixes(self, prefixes):
+        """Removes every key starting with one of the prefixes (a tuple)."""
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefixes)]:
+                del self._entries[key]
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] >= time.time()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class DiskCache:
+    """One JSON file per key inside a directory. Writes are atomic (temp file + rename)."""
+
+    def __init__(self, directory, ttl=3600):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Returns (expires_at, value) or None if missing or expired."""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading cache entry {path}: {e}")
+            return None
+        if entry.get("expires_at", 0) < time.time():
+            self.delete(key)
+            return None
+        return entry["expires_at"], entry.get("value")
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"expires_at": expires_at, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error writing cache entry {path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self, prefixes=("",)):
+        """Deletes all entries, or those whose key starts with one of the prefixes."""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(".json") and name.startswith(prefixes):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+class TieredCache:
+    """Memory LRU in front of an optional DiskCache. Disk hits are promoted to memory."""
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                self.disk_hits += 1
+                self.memory.set(key, value, ttl=expires_at - time.time())
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None, persist=True):
+        self.memory.set(key, value, ttl=ttl)
+        if persist and self.disk is not None:
+            self.disk.set(key, value, ttl=ttl)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self.memory.clear()
+            if self.disk is not None:
+                self.disk.clear()
+            return
+        self.memory.pop(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def invalidate_prefixes(self, prefixes):
+        """Drops every entry whose key starts with one of the prefixes, in both tiers."""
+        prefixes = tuple(prefixes)
+        if not prefixes:
+            return
+        self.memory.pop_prefixes(prefixes)
+        if self.disk is not None:
+            self.disk.clear(prefixes)
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self.memory),
+            "max_entries": self.memory.max_entries,
+            "evictions": self.memory.evictions,
+        }
+
+
+class ResponseCache:
+    """
+    Caches raw GET responses according to a per-endpoint policy table.
+
+    policies maps a name to {"path": <path prefix>, "ttl": seconds, "max_entries": n,
+    "vary": (...)}, where vary lists request context values ("device_type", "region",
+    "user") that become part of the cache key. Each policy has its own memory LRU;
+    entries evicted from memory are spilled to SQLite when spill_path is set.
+    Stored values are (status_code, headers, content) tuples.
+    """
+
+    def __init__(self, policies, spill_path=None):
+        self.policies = policies
+        self._memory = {name: LRUCache(p["max_entries"], p["ttl"]) for name, p in policies.items()}
+        self.spill_path = spill_path
+        self.spill_hits = 0
+        self._spill_lock = threading.Lock()
+        if spill_path:
+            with self._spill() as db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, policy TEXT, expires_at REAL, "
+                    "status INTEGER, headers TEXT, content BLOB)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS responses_policy ON responses(policy)")
+
+    def _spill(self):
+        return _SpillConnection(sqlite3.connect(self.spill_path, timeout=5), self._spill_lock)
+
+    def match(self, path):
+        """Returns the policy name whose path prefix matches, or None."""
+        for name, policy in self.policies.items():
+            if path.startswith(policy["path"]):
+                return name
+        return None
+
+    def key(self, name, url, context):
+        vary = self.policies[name].get("vary", ())
+        return url + "".join(f"|{field}={context.get(field)}" for field in vary)
+
+    def get(self, name, key):
+        value = self._memory[name].get(key)
+        if value is not None or not self.spill_path:
+            return value
+        with self._spill() as db:
+            row = db.execute(
+                "SELECT expires_at, status, headers, content FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[0] < time.time():
+            return None
+        self.spill_hits += 1
+        value = (row[1], json.loads(row[2]), row[3])
+        self._store(name, key, value, ttl=row[0] - time.time())
+        return value
+
+    def set(self, name, key, value):
+        self._store(name, key, value)
+
+    def _store(self, name, key, value, ttl=None):
+        evicted = self._memory[name].set(key, value, ttl=ttl)
+        if evicted and self.spill_path:
+            with self._spill() as db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (old_key, name, expires_at, status, json.dumps(headers), content)
+                        for old_key, expires_at, (status, headers, content) in evicted
+                        if expires_at > time.time()
+                    ],
+                )
+
+    def invalidate(self, name=None):
+        """Drops all entries of one policy, or of every policy when name is None."""
+        names = [name] if name else list(self.policies)
+        for n in names:
+            self._memory[n].clear()
+        if self.spill_path:
+            with self._spill() as db:
+                if name:
+                    db.execute("DELETE FROM responses WHERE policy = ?", (name,))
+                else:
+                    db.execute("DELETE FROM responses")
+
+    def stats(self):
+        result = {name: lru.stats() for name, lru in self._memory.items()}
+        if self.spill_path:
+            result["spill_hits"] = self.spill_hits
+        return result
+
+
+class _SpillConnection:
+    """Context manager that serialises access to the spill database and commits on exit."""
+
+    def __init__(self, connection, lock):
+        self.connection = connection
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.connection.commit()
+            self.connection.close()
+        finally:
+            self.lock.release()
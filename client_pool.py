@@ -0,0 +1,87 @@
+"""
+Pool of SpeedianceClient instances keyed by account, so one server can serve several
+Speediance accounts. Each client keeps its own credentials, connection pool and
+journal; reference data lives in one SharedResources object.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class ClientPool:
+    """
+    Creates clients on demand with factory(key) and evicts the ones idle for longer than
+    idle_ttl seconds. When more than max_clients are alive the least recently used one is
+    evicted as well. Evicted clients are closed; their settings stay on disk, so the next
+    request for the same key simply builds a fresh client.
+    """
+
+    def __init__(self, factory, idle_ttl=1800, max_clients=64):
+        self.factory = factory
+        self.idle_ttl = idle_ttl
+        self.max_clients = max_clients
+        self._clients = OrderedDict()  # key -> (client, last_used)
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is None:
+                client = self.factory(key)
+                self.created += 1
+            else:
+                client = entry[0]
+            self._clients[key] = (client, now)
+            self._clients.move_to_end(key)
+            evicted = self._collect(now, keep=key)
+        for old in evicted:
+            self._close(old)
+        return client
+
+    def _collect(self, now, keep=None):
+        """Removes idle and surplus entries (oldest first); returns the clients to close."""
+        evicted = []
+        for key, (client, last_used) in list(self._clients.items()):
+            if key == keep:
+                continue
+            if now - last_used > self.idle_ttl or len(self._clients) > self.max_clients:
+                del self._clients[key]
+                evicted.append(client)
+        self.evictions += len(evicted)
+        return evicted
+
+    def evict_idle(self):
+        with self._lock:
+            evicted = self._collect(time.monotonic())
+        for client in evicted:
+            self._close(client)
+        return len(evicted)
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._clients.pop(key, None)
+        if entry:
+            self._close(entry[0])
+
+    @staticmethod
+    def _close(client):
+        try:
+            client.close()
+        except Exception as e:
+            print(f"Error closing client: {e}")
+
+    def __len__(self):
+        return len(self._clients)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "max_clients": self.max_clients,
+                "idle_ttl": self.idle_ttl,
+                "created": self.created,
+                "evictions": self.evictions,
+            }
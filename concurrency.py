@@ -0,0 +1,162 @@
+"""
+Concurrency helpers shared by every upstream fan-out in SpeedianceClient.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class ConcurrencyGovernor:
+    """
+    Adaptive (AIMD) limit on in-flight upstream requests.
+
+    The limit grows by one after `limit` consecutive healthy responses and is halved
+    on 429/5xx/connection errors, or when the p95 latency of the recent window rises
+    above latency_factor times its smoothed baseline. Back-offs are rate limited so a
+    burst of concurrent failures only halves the limit once.
+    """
+
+    def __init__(self, initial=6, minimum=1, maximum=32, window=40, latency_factor=2.0, cooldown=1.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.limit = initial
+        self.in_flight = 0
+        self.requests = 0
+        self.throttle_events = 0
+        self.last_throttle = None
+        self._latencies = deque(maxlen=window)
+        self._baseline_p95 = None
+        self._last_p95 = None
+        self._healthy_streak = 0
+        self._last_backoff = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def record(self, latency, status):
+        """Feeds back one finished request. status is None for connection errors."""
+        with self._cond:
+            self.requests += 1
+            if status is None or status == 429 or status >= 500:
+                self._back_off(f"status {status}" if status else "connection error")
+                return
+
+            self._latencies.append(latency)
+            if len(self._latencies) == self._latencies.maxlen:
+                p95 = self._p95()
+                self._last_p95 = p95
+                if self._baseline_p95 is not None and p95 > self._baseline_p95 * self.latency_factor:
+                    self._latencies.clear()
+                    self._back_off("p95 latency rising")
+                    return
+                # Smoothed baseline only follows healthy windows
+                self._baseline_p95 = p95 if self._baseline_p95 is None else 0.9 * self._baseline_p95 + 0.1 * p95
+                self._latencies.clear()
+
+            self._healthy_streak += 1
+            if self._healthy_streak >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._healthy_streak = 0
+                self._cond.notify()
+
+    def _back_off(self, reason):
+        now = time.monotonic()
+        self._healthy_streak = 0
+        if now - self._last_backoff < self.cooldown:
+            return
+        self._last_backoff = now
+        self.limit = max(self.minimum, self.limit // 2)
+        self.throttle_events += 1
+        self.last_throttle = {"reason": reason, "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "limit": self.limit}
+        print(f"[THROTTLE] Upstream {reason}; concurrency limit lowered to {self.limit}")
+
+    def _p95(self):
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "throttle_events": self.throttle_events,
+                "last_throttle": self.last_throttle,
+                "p95_ms": round(self._last_p95 * 1000, 1) if self._last_p95 is not None else None,
+                "baseline_p95_ms": round(self._baseline_p95 * 1000, 1) if self._baseline_p95 is not None else None,
+            }
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one execution.
+    The first caller runs the function; callers arriving while it is in flight wait
+    for it and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, func):
+        """Returns (result, shared) where shared is True for callers that joined another call."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {"executions": self.executions, "coalesced": self.coalesced, "in_flight": in_flight}
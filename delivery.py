@@ -0,0 +1,180 @@
+"""
+Response delivery helpers: content hashes, precompressed variants and
+Accept-Encoding negotiation. Brotli is used when the `brotli` package is installed.
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred order when the client accepts several encodings
+ENCODING_PREFERENCE = ("br", "gzip")
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+
+def content_hash(data, length=16):
+    return hashlib.sha256(data).hexdigest()[:length]
+
+
+def compress(data, encoding, fast=False):
+    """Compresses bytes with "gzip" or "br". fast trades ratio for speed (per-response use)."""
+    if encoding == "gzip":
+        return gzip.compress(data, 6 if fast else GZIP_LEVEL)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(data, quality=5 if fast else BROTLI_QUALITY)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def available_encodings():
+    return tuple(e for e in ENCODING_PREFERENCE if e != "br" or brotli is not None)
+
+
+def accepted_encodings(accept_encoding):
+    """Encodings listed in an Accept-Encoding header with a non-zero q value."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.add(name)
+    return accepted
+
+
+def negotiate(accept_encoding, available):
+    """The preferred encoding out of `available` the client accepts, or None for identity."""
+    accepted = accepted_encodings(accept_encoding)
+    for encoding in ENCODING_PREFERENCE:
+        if encoding in available and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+
+class PrecompressedPayload:
+    """An immutable body, its content hash and its compressed variants (built once)."""
+
+    def __init__(self, body, mimetype="application/json"):
+        self.body = body
+        self.mimetype = mimetype
+        self.version = content_hash(body)
+        self.variants = {encoding: compress(body, encoding) for encoding in available_encodings()}
+
+    def select(self, accept_encoding):
+        """Returns (encoding or None, bytes) for a request's Accept-Encoding header."""
+        encoding = negotiate(accept_encoding, self.variants)
+        if encoding is None:
+            return None, self.body
+        return encoding, self.variants[encoding]
+
+
+# Static files that get .gz/.br siblings
+PRECOMPRESS_EXTENSIONS = {".js", ".css", ".svg", ".json", ".html", ".txt", ".map"}
+
+
+class AssetManifest:
+    """
+    Content hashes of the files under a static folder, mapped to fingerprinted names
+    ("workout-logic.js" -> "workout-logic.1a2b3c4d5e6f7a8b.js"). Text assets get .gz/.br
+    siblings written next to them; the originals keep their names on disk.
+
+    The manifest is empty until build() has run; build_in_background() keeps the hashing
+    and compression off the startup path (url_path() returns None meanwhile).
+    """
+
+    def __init__(self, root, exclude=("media_cache",)):
+        self.root = root
+        self.exclude = set(exclude)
+        self.assets = {}  # relative path -> (version, {encoding: sibling path})
+        self.fingerprinted = {}  # fingerprinted relative path -> relative path
+        self.ready = threading.Event()
+
+    @staticmethod
+    def fingerprint(rel_path, version):
+        base, ext = os.path.splitext(rel_path)
+        return f"{base}.{version}{ext}"
+
+    def build(self):
+        assets, fingerprinted = {}, {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d not in self.exclude]
+            for filename in filenames:
+                if filename.startswith(".") or filename.endswith((".gz", ".br")):
+                    continue
+                path = os.path.join(dirpath, filename)
+                rel_path = os.path.relpath(path, self.root).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    data = f.read()
+                version = content_hash(data)
+                siblings = {}
+                if os.path.splitext(filename)[1].lower() in PRECOMPRESS_EXTENSIONS:
+                    siblings = self._precompress(path, data)
+                assets[rel_path] = (version, siblings)
+                fingerprinted[self.fingerprint(rel_path, version)] = rel_path
+        # Readers look up fingerprinted first, so assets has to be complete before it
+        self.assets = assets
+        self.fingerprinted = fingerprinted
+        self.ready.set()
+        print(f"[ASSETS] Static asset manifest built: {len(assets)} files.")
+        return len(assets)
+
+    def build_in_background(self):
+        def run():
+            try:
+                self.build()
+            except Exception as e:
+                print(f"[ERROR] Building the static asset manifest failed, serving plain /static URLs: {e}")
+        threading.Thread(target=run, daemon=True).start()
+
+    @staticmethod
+    def _precompress(path, data):
+        """Writes (or reuses up-to-date) compressed siblings; returns {encoding: path}."""
+        siblings = {}
+        source_mtime = os.path.getmtime(path)
+        for encoding in available_encodings():
+            sibling = f"{path}.{'br' if encoding == 'br' else 'gz'}"
+            try:
+                if not os.path.exists(sibling) or os.path.getmtime(sibling) < source_mtime:
+                    tmp = f"{sibling}.tmp"
+                    with open(tmp, "wb") as f:
+                        f.write(compress(data, encoding))
+                    os.replace(tmp, sibling)
+                siblings[encoding] = sibling
+            except OSError as e:
+                # Read-only install: serve the original uncompressed
+                print(f"[ASSETS] Could not precompress {path}: {e}")
+        return siblings
+
+    def url_path(self, rel_path):
+        """Fingerprinted name of an asset, or None if it is not in the manifest."""
+        entry = self.assets.get(rel_path)
+        return self.fingerprint(rel_path, entry[0]) if entry else None
+
+    def resolve(self, fingerprinted_path):
+        """(relative path, version, {encoding: sibling path}) for a fingerprinted name, or None."""
+        rel_path = self.fingerprinted.get(fingerprinted_path)
+        entry = self.assets.get(rel_path) if rel_path is not None else None
+        if entry is None:
+            return None
+        version, siblings = entry
+        return rel_path, version, siblings
+
+
+if __name__ == "__main__":
+    # Build step: python delivery.py [static folder] writes the .gz/.br siblings ahead of
+    # time, so the app's startup build only has to hash the files.
+    import sys
+    AssetManifest(sys.argv[1] if len(sys.argv) > 1 else "static").build()
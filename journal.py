@@ -0,0 +1,147 @@
+"""
+Bounded in-memory journal of recent upstream exchanges (used by /debug/last_response).
+
+Recording keeps references to objects the request already produced (prepared request
+headers) plus the first body_limit bytes of the response, so the buffer's memory stays
+bounded; decoding and redaction happen when an entry is read.
+"""
+import contextvars
+import json
+import random
+import threading
+import time
+from collections import deque
+
+# Id of the incoming (Flask) request on whose behalf upstream calls are made.
+journal_context = contextvars.ContextVar("speediance_journal_context", default=None)
+
+REDACTED = "***"
+SENSITIVE_KEYS = {"token", "password", "app_user_id", "authorization", "cookie", "set-cookie"}
+
+
+def _redact(value):
+    if isinstance(value, dict):
+        return {k: (REDACTED if str(k).lower() in SENSITIVE_KEYS else _redact(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+
+class JournalEntry:
+    __slots__ = (
+        "timestamp", "method", "url", "status", "elapsed_ms", "context",
+        "request_headers", "request_body", "response_content", "truncated", "error",
+    )
+
+    def __init__(self, method, url, context, status=None, elapsed_ms=None,
+                 request_headers=None, request_body=None, response_content=None, truncated=False, error=None):
+        self.timestamp = time.time()
+        self.method = method
+        self.url = url
+        self.context = context
+        self.status = status
+        self.elapsed_ms = elapsed_ms
+        self.request_headers = request_headers
+        self.request_body = request_body
+        self.response_content = response_content
+        self.truncated = truncated
+        self.error = error
+
+    def _response_body(self):
+        content = self.response_content
+        if content is None:
+            return None
+        if not self.truncated:
+            try:
+                return _redact(json.loads(content))
+            except ValueError:
+                pass
+        text = content.decode("utf-8", errors="replace")
+        return text + "..." if self.truncated else text
+
+    def to_dict(self):
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.timestamp)),
+            "method": self.method,
+            "url": self.url,
+            "request_id": self.context,
+        }
+        if self.error is not None:
+            entry["error"] = self.error
+            return entry
+        entry.update({
+            "status": self.status,
+            "elapsed_ms": self.elapsed_ms,
+            "request_headers": _redact(dict(self.request_headers or {})),
+            "request_body": _redact(self.request_body),
+            "response_body": self._response_body(),
+        })
+        return entry
+
+
+class RequestJournal:
+    """
+    Ring buffer of the last `capacity` upstream exchanges.
+
+    sample_rate 0 turns recording off, values below 1 record that fraction of
+    successful exchanges (errors are always kept). Response bodies are kept up to
+    body_limit bytes.
+    """
+
+    def __init__(self, capacity=50, sample_rate=1.0, body_limit=4096):
+        self.sample_rate = sample_rate
+        self.body_limit = body_limit
+        self._entries = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def record(self, method, url, status=None, elapsed=None, request_headers=None,
+               request_body=None, response_content=None, error=None):
+        if self.sample_rate <= 0:
+            return
+        if error is None and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        truncated = response_content is not None and len(response_content) > self.body_limit
+        if truncated:
+            response_content = response_content[:self.body_limit]
+        entry = JournalEntry(
+            method, url, journal_context.get(),
+            status=status,
+            elapsed_ms=round(elapsed * 1000, 1) if elapsed is not None else None,
+            request_headers=request_headers,
+            request_body=request_body,
+            response_content=response_content,
+            truncated=truncated,
+            error=error,
+        )
+        with self._lock:
+            self._entries.append(entry)
+
+    def latest(self):
+        with self._lock:
+            entry = self._entries[-1] if self._entries else None
+        return entry.to_dict() if entry else {}
+
+    def entries(self, limit=20, request_id=None, method=None, status=None, url_contains=None, errors_only=False):
+        """Returns matching entries, newest first."""
+        with self._lock:
+            snapshot = list(self._entries)
+        result = []
+        for entry in reversed(snapshot):
+            if request_id and entry.context != request_id:
+                continue
+            if method and entry.method != method.upper():
+                continue
+            if status is not None and entry.status != status:
+                continue
+            if url_contains and url_contains not in entry.url:
+                continue
+            if errors_only and entry.error is None and (entry.status or 0) < 400:
+                continue
+            result.append(entry.to_dict())
+            if len(result) >= limit:
+                break
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,212 @@
+"""
+Derived fields of the exercise library, computed once per library/accessory list
+instead of on every page render.
+
+Each accessory id gets one bit, so an exercise's required accessories become an
+integer mask and "can be done with the owned equipment" is a single AND.
+"""
+import base64
+import json
+
+# Categories whose exercises need at least one of these accessories even when the
+# exercise itself lists none (Pilates needs Pilates Loops or Pilates Straps).
+CATEGORY_REQUIRED_ACCESSORIES = {18: (11, 12)}
+
+
+def parse_accessory_ids(value):
+    """Accessory ids from the comma separated `accessories` field, in order."""
+    ids = []
+    for part in str(value or '').split(','):
+        part = part.strip()
+        if part.isdigit():
+            ids.append(int(part))
+    return ids
+
+
+class DerivedExercise:
+    __slots__ = ("equipment_name", "device_tag", "device_types", "accessory_mask")
+
+    def __init__(self, equipment_name, device_tag, device_types, accessory_mask):
+        self.equipment_name = equipment_name
+        self.device_tag = device_tag
+        self.device_types = device_types
+        self.accessory_mask = accessory_mask
+
+
+class LibraryIndex:
+    """
+    Derived view of one library list. `library` and `accessories` are the objects it
+    was built from; is_current() tells whether a rebuild is needed.
+    """
+
+    def __init__(self, library, accessories):
+        self.library = library
+        self.accessory_signature = self.signature(accessories)
+        names = {int(acc['id']): acc.get('name') for acc in accessories if str(acc.get('id', '')).isdigit()}
+
+        required = {ex.get('id'): parse_accessory_ids(ex.get('accessories')) for ex in library}
+        all_ids = set(names)
+        for ids in required.values():
+            all_ids.update(ids)
+        for ids in CATEGORY_REQUIRED_ACCESSORIES.values():
+            all_ids.update(ids)
+        self.accessory_bits = {acc_id: 1 << pos for pos, acc_id in enumerate(sorted(all_ids))}
+        self.category_masks = {cat: self.mask(ids) for cat, ids in CATEGORY_REQUIRED_ACCESSORIES.items()}
+
+        self.entries = {}
+        for ex in library:
+            acc_ids = required[ex.get('id')]
+            equipment = [names.get(acc_id) or 'Standard' for acc_id in acc_ids]
+            device_types = tuple(t for t in (ex.get('device_type_list') or [ex.get('device_type')]) if t)
+            self.entries[ex.get('id')] = DerivedExercise(
+                equipment_name=', '.join(equipment) if equipment else 'Standard',
+                device_tag=ex.get('device_type_tag') or ",".join(str(t) for t in device_types),
+                device_types=frozenset(device_types),
+                accessory_mask=self.mask(acc_ids),
+            )
+
+    @staticmethod
+    def signature(accessories):
+        return tuple((acc.get('id'), acc.get('name')) for acc in accessories)
+
+    def is_current(self, library, accessories):
+        return self.library is library and self.accessory_signature == self.signature(accessories)
+
+    def mask(self, accessory_ids):
+        mask = 0
+        for acc_id in accessory_ids:
+            mask |= self.accessory_bits.get(int(acc_id), 0)
+        return mask
+
+    def get(self, exercise_id):
+        return self.entries.get(exercise_id)
+
+    def usable_with(self, exercise, owned_mask):
+        """True if the owned accessories (as a mask) cover what the exercise and its category need."""
+        entry = self.entries.get(exercise.get('id'))
+        if entry is None:
+            return True
+        if entry.accessory_mask & ~owned_mask:
+            return False
+        any_of = self.category_masks.get(exercise.get('category_id'))
+        return not any_of or bool(any_of & owned_mask)
+
+
+# Fields returned by query_library() when no projection is requested.
+DEFAULT_FIELDS = (
+    "id", "title", "img", "category_id", "category_name", "trainingPartId2",
+    "mainMuscleGroupName", "auxiliaryMuscleGroupList", "isBarbell",
+    "device_tag", "equipment_name", "accessory_mask",
+)
+DERIVED_FIELDS = ("device_tag", "equipment_name", "accessory_mask")
+# Fields of the versioned library payload create.html loads (prompt generator and the
+# JSON import's title/image lookup)
+PAYLOAD_FIELDS = (
+    "id", "title", "img", "category_id", "category_name", "trainingPartId2",
+    "mainMuscleGroupName", "auxiliaryMuscleGroupList",
+)
+
+SORT_KEYS = {
+    "position": lambda ex, pos: (pos,),
+    "title": lambda ex, pos: ((ex.get('title') or '').lower(), pos),
+    "id": lambda ex, pos: (ex.get('id') or 0,),
+    "category": lambda ex, pos: ((ex.get('category_name') or '').lower(), pos),
+}
+# Types of the sort key components a cursor carries, per sort
+CURSOR_TYPES = {
+    "position": (int,),
+    "title": (str, int),
+    "id": (int,),
+    "category": (str, int),
+    "relevance": (int, int),
+}
+
+
+def encode_cursor(sort, key):
+    """Opaque cursor: the sort it belongs to plus the sort key of the last item returned."""
+    return base64.urlsafe_b64encode(json.dumps([sort, *key]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        cursor_sort, *key = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor belongs to a different sort order")
+    # The key is compared with sort keys later on; wrong types must fail here, not there
+    types = CURSOR_TYPES.get(sort.lstrip("-"))
+    if types is None or len(key) != len(types) or not all(
+            isinstance(value, t) and not isinstance(value, bool) for value, t in zip(key, types)):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+
+def query_library(index, category_ids=None, device_type=None, muscle=None, ids=None,
+                  owned_mask=None, owned_devices=None, relevance=None, sort="position", cursor=None,
+                  limit=60, fields=None):
+    """
+    Filters, sorts and pages the library an index was built from.
+
+    owned_mask / owned_devices restrict results to exercises doable with that equipment
+    (None = no restriction). relevance ({id: rank}, e.g. from a search) restricts results
+    to those ids and enables sort="relevance". sort is a SORT_KEYS name, "-" prefixed for
+    descending. cursor is the next_cursor of the previous page. Returns {"items",
+    "next_cursor", "total", "equipment_hidden"}, items projected to `fields` (default
+    DEFAULT_FIELDS).
+    """
+    descending = sort.startswith("-")
+    if sort.lstrip("-") == "relevance" and relevance is not None:
+        sort_key = lambda ex, pos: (relevance[ex.get('id')], pos)
+    else:
+        sort_key = SORT_KEYS.get(sort.lstrip("-"))
+    if sort_key is None:
+        raise ValueError(f"Unknown sort: {sort}")
+    category_ids = set(category_ids) if category_ids else None
+    ids = set(ids) if ids else None
+    owned_devices = set(owned_devices) if owned_devices else None
+
+    matches = []
+    equipment_hidden = 0
+    for pos, ex in enumerate(index.library):
+        entry = index.entries.get(ex.get('id'))
+        if entry is None:
+            continue
+        if ids is not None and ex.get('id') not in ids:
+            continue
+        if relevance is not None and ex.get('id') not in relevance:
+            continue
+        if category_ids is not None and ex.get('category_id') not in category_ids:
+            continue
+        if device_type is not None and device_type not in entry.device_types:
+            continue
+        if muscle is not None and ex.get('trainingPartId2') != muscle:
+            continue
+        if (owned_mask is not None and not index.usable_with(ex, owned_mask)) or \
+                (owned_devices is not None and not entry.device_types & owned_devices):
+            equipment_hidden += 1
+            continue
+        matches.append((sort_key(ex, pos), ex, entry))
+
+    matches.sort(key=lambda m: m[0], reverse=descending)
+    total = len(matches)
+    if cursor:
+        after = decode_cursor(cursor, sort)
+        matches = [m for m in matches if (m[0] < after if descending else m[0] > after)]
+    page = matches[:limit]
+    next_cursor = encode_cursor(sort, page[-1][0]) if len(matches) > limit else None
+
+    fields = fields or DEFAULT_FIELDS
+    items = []
+    for _, ex, entry in page:
+        item = {}
+        for field in fields:
+            if field in DERIVED_FIELDS:
+                value = getattr(entry, field)
+                # Masks can exceed 2**53, so they travel as strings
+                item[field] = str(value) if field == "accessory_mask" else value
+            elif field in ex:
+                item[field] = ex[field]
+        items.append(item)
+    return {"items": items, "next_cursor": next_cursor, "total": total, "equipment_hidden": equipment_hidden}
@@ -0,0 +1,193 @@
+"""
+SQLite storage for the exercise library.
+
+Exercise details are stored once per id and shared by every library variant
+(device type + monster-move flag). Each variant only owns its ordering and the
+category/device tags of its entries, so a PAL library with monster moves and a
+plain Monster library reuse the same exercise rows.
+
+Reads are either a whole variant (load) or a set of ids (get_many, e.g. the group
+metadata of a workout being saved); filtering is done on the in-memory LibraryIndex.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+# Keys that belong to a variant's entry rather than to the shared exercise row
+ENTRY_KEYS = ("category_id", "category_name", "device_type_list", "device_type_tag")
+# Keys computed by the app that are never persisted
+DERIVED_KEYS = ("equipment_name",)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exercise (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS library_entry (
+    variant TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    category_id INTEGER,
+    category_name TEXT,
+    PRIMARY KEY (variant, id)
+);
+CREATE INDEX IF NOT EXISTS library_entry_id ON library_entry(id);
+CREATE INDEX IF NOT EXISTS library_entry_position ON library_entry(variant, position);
+CREATE TABLE IF NOT EXISTS entry_device (
+    variant TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    device_type INTEGER NOT NULL,
+    PRIMARY KEY (variant, id, device_type)
+);
+-- Filter indexes of earlier versions; filtering happens on the in-memory LibraryIndex
+DROP INDEX IF EXISTS library_entry_category;
+DROP INDEX IF EXISTS entry_device_type;
+DROP TABLE IF EXISTS exercise_accessory;
+CREATE TABLE IF NOT EXISTS variant (
+    name TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class LibraryStore:
+    """Indexed, transactional library storage. One short-lived connection per operation."""
+
+    def __init__(self, path):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._ready = True
+        return conn
+
+    # ── Reads ─────────────────────────────────────────────
+
+    @staticmethod
+    def _row_to_exercise(data, category_id, category_name, device_types):
+        exercise = json.loads(data)
+        device_list = sorted(int(t) for t in device_types.split(',')) if device_types else []
+        exercise['category_id'] = category_id
+        exercise['category_name'] = category_name
+        exercise['device_type_list'] = device_list
+        exercise['device_type_tag'] = ",".join(str(t) for t in device_list)
+        return exercise
+
+    def _select(self, variant, where="", params=()):
+        sql = (
+            "SELECT e.data, l.category_id, l.category_name, "
+            "(SELECT group_concat(d.device_type) FROM entry_device d WHERE d.variant = l.variant AND d.id = l.id) "
+            "FROM library_entry l JOIN exercise e ON e.id = l.id "
+            f"WHERE l.variant = ? {where} ORDER BY l.position"
+        )
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, (variant,) + tuple(params)).fetchall()
+        finally:
+            conn.close()
+        return [self._row_to_exercise(*row) for row in rows]
+
+    def has_variant(self, variant):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT 1 FROM variant WHERE name = ?", (variant,)).fetchone() is not None
+        finally:
+            conn.close()
+
+    def load(self, variant):
+        """Returns the full library of a variant in its original order, or None if not stored."""
+        if not self.has_variant(variant):
+            return None
+        return self._select(variant)
+
+    def get_many(self, variant, exercise_ids):
+        """Entries of a variant for the given ids, in library order; unknown ids are skipped."""
+        ids = [int(i) for i in exercise_ids]
+        if not ids:
+            return []
+        placeholders = ",".join("?" * len(ids))
+        return self._select(variant, f"AND l.id IN ({placeholders})", ids)
+
+    # ── Writes ────────────────────────────────────────────
+
+    @staticmethod
+    def _upsert_exercises(conn, exercises):
+        conn.executemany(
+            "INSERT INTO exercise (id, data) VALUES (?, ?) ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+            [
+                (int(ex['id']), json.dumps({k: v for k, v in ex.items() if k not in ENTRY_KEYS and k not in DERIVED_KEYS}, ensure_ascii=False))
+                for ex in exercises
+            ],
+        )
+
+    @staticmethod
+    def _write_entries(conn, variant, library):
+        conn.execute("DELETE FROM library_entry WHERE variant = ?", (variant,))
+        conn.execute("DELETE FROM entry_device WHERE variant = ?", (variant,))
+        conn.executemany(
+            "INSERT INTO library_entry (variant, id, position, category_id, category_name) VALUES (?, ?, ?, ?, ?)",
+            [
+                (variant, int(ex['id']), pos, ex.get('category_id'), ex.get('category_name'))
+                for pos, ex in enumerate(library)
+            ],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO entry_device (variant, id, device_type) VALUES (?, ?, ?)",
+            [
+                (variant, int(ex['id']), int(t))
+                for ex in library
+                for t in (ex.get('device_type_list') or [])
+                if t
+            ],
+        )
+
+    @staticmethod
+    def _prune_orphans(conn):
+        conn.execute("DELETE FROM exercise WHERE id NOT IN (SELECT id FROM library_entry)")
+
+    def _transaction(self, work):
+        with self._write_lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    work(conn)
+            finally:
+                conn.close()
+
+    def replace(self, variant, library):
+        """Stores a complete library for a variant in one transaction."""
+        def work(conn):
+            self._upsert_exercises(conn, library)
+            self._write_entries(conn, variant, library)
+            self._prune_orphans(conn)
+            conn.execute("INSERT OR REPLACE INTO variant (name, updated_at) VALUES (?, ?)", (variant, time.time()))
+        self._transaction(work)
+
+    def apply_delta(self, variant, library, changed_ids, removed_ids):
+        """
+        Incremental write after a sync: only exercise rows in changed_ids are rewritten;
+        entry rows (order and tags, a few bytes each) are refreshed for the variant.
+        """
+        changed = {int(i) for i in changed_ids}
+
+        def work(conn):
+            self._upsert_exercises(conn, [ex for ex in library if int(ex['id']) in changed])
+            self._write_entries(conn, variant, library)
+            if removed_ids:
+                self._prune_orphans(conn)
+            conn.execute("INSERT OR REPLACE INTO variant (name, updated_at) VALUES (?, ?)", (variant, time.time()))
+        self._transaction(work)
+
+    def delete_variant(self, variant):
+        def work(conn):
+            conn.execute("DELETE FROM library_entry WHERE variant = ?", (variant,))
+            conn.execute("DELETE FROM entry_device WHERE variant = ?", (variant,))
+            conn.execute("DELETE FROM variant WHERE name = ?", (variant,))
+            self._prune_orphans(conn)
+        self._transaction(work)
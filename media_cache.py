@@ -0,0 +1,239 @@
+"""
+Downloads for the local media cache.
+
+A miss starts one background download per URL. The bytes go to a temporary ".part"
+file which is renamed to the cache path only once complete, so an interrupted download
+never looks like a cache hit. Requests arriving while a download is running join it and
+stream the bytes already written, then follow the file as it grows.
+"""
+import os
+import threading
+import time
+import uuid
+
+import requests
+
+PARTIAL_SUFFIX = ".part"
+
+
+class MediaDownload:
+    """State of one download. `cond` guards every field and every open of the temp file."""
+
+    def __init__(self, url, path):
+        self.url = url
+        self.path = path
+        self.tmp_path = f"{path}.{uuid.uuid4().hex[:8]}{PARTIAL_SUFFIX}"
+        self.cond = threading.Condition()
+        self.status = None  # upstream status code once the response headers arrived
+        self.content_type = None
+        self.content_length = None
+        self.written = 0
+        self.done = False
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.done or self.error is not None
+
+    def wait_for_headers(self, timeout):
+        """True once the upstream answered (or failed)."""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.status is not None or self.error is not None, timeout)
+
+    def wait(self, timeout=None):
+        with self.cond:
+            return self.cond.wait_for(lambda: self.finished, timeout)
+
+    def stream(self, start=0, stop=None, chunk_size=65536, stall_timeout=30):
+        """
+        Yields bytes start..stop (exclusive; None = to the end), following the temp file
+        until the download ends. Bytes not written yet are waited for; the stream ends
+        if the download makes no progress for stall_timeout seconds.
+        """
+        pos = start
+        while stop is None or pos < stop:
+            with self.cond:
+                while pos >= self.written and not self.finished:
+                    if not self.cond.wait(stall_timeout):
+                        return
+                # A failed download deletes its temp file: end the response instead of
+                # reading what is left of it
+                if self.error is not None or pos >= self.written:
+                    return
+                size = min(chunk_size, self.written - pos)
+                if stop is not None:
+                    size = min(size, stop - pos)
+                # The temp file is only opened under the lock, so the rename never meets an
+                # open handle (Windows refuses to rename open files)
+                try:
+                    with open(self.path if self.done else self.tmp_path, 'rb') as f:
+                        f.seek(pos)
+                        data = f.read(size)
+                except OSError:
+                    return
+            if not data:
+                return
+            pos += len(data)
+            yield data
+
+
+class MediaDownloader:
+    """Coalesces concurrent downloads of the same URL into one upstream request."""
+
+    def __init__(self, timeout=10, chunk_size=65536, on_complete=None):
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.on_complete = on_complete  # called with (url, path) after a successful download
+        self._downloads = {}  # cache path -> MediaDownload
+        self._lock = threading.Lock()
+        self.started = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def start(self, url, path):
+        """Returns the running download for path (starting one if needed), or None if path is cached."""
+        with self._lock:
+            download = self._downloads.get(path)
+            if download is not None:
+                self.coalesced += 1
+                return download
+            if os.path.exists(path):
+                return None
+            download = self._downloads[path] = MediaDownload(url, path)
+            self.started += 1
+        threading.Thread(target=self._run, args=(download,), daemon=True).start()
+        return download
+
+    def fetch(self, url, path, timeout=None):
+        """Blocking download (joins a running one). Returns "cached", "downloaded" or "failed (...)"."""
+        download = self.start(url, path)
+        if download is None:
+            return "cached"
+        if not download.wait(timeout):
+            return "failed (timeout)"
+        if download.error is not None:
+            return f"failed ({download.error})"
+        return "downloaded"
+
+    def _run(self, download):
+        try:
+            os.makedirs(os.path.dirname(download.path), exist_ok=True)
+            with requests.get(download.url, stream=True, timeout=self.timeout) as resp:
+                with download.cond:
+                    download.status = resp.status_code
+                    download.content_type = resp.headers.get('Content-Type')
+                    download.content_length = resp.headers.get('Content-Length')
+                    if resp.status_code != 200:
+                        raise IOError(f"status {resp.status_code}")
+                    download.cond.notify_all()
+                with open(download.tmp_path, 'wb') as f:
+                    for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        f.flush()
+                        with download.cond:
+                            download.written += len(chunk)
+                            download.cond.notify_all()
+            with download.cond:
+                os.replace(download.tmp_path, download.path)
+                download.done = True
+                download.cond.notify_all()
+            if self.on_complete:
+                self.on_complete(download.url, download.path)
+        except Exception as e:
+            self.failed += 1
+            with download.cond:
+                download.error = e
+                try:
+                    os.remove(download.tmp_path)
+                except OSError:
+                    pass
+                download.cond.notify_all()
+        finally:
+            with self._lock:
+                self._downloads.pop(download.path, None)
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._downloads)
+        return {"started": self.started, "coalesced": self.coalesced, "failed": self.failed, "in_flight": in_flight}
+
+
+class MediaCacheIndex:
+    """
+    In-memory set of the files in the media cache, so "is this URL cached?" needs no
+    filesystem call. Loaded by one directory walk, then kept current by add()/discard().
+
+    Until load() has finished the index only knows what add() told it, so callers see
+    a miss (a remote URL) rather than waiting for the walk.
+    """
+
+    def __init__(self):
+        self._paths = set()
+        self._discarded = None  # paths discard()ed while load() walks, None otherwise
+        self._lock = threading.Lock()
+        self.ready = threading.Event()
+
+    def load(self, root, partial_before=None):
+        """
+        Indexes the files under root and removes the temp files of downloads a crash
+        interrupted, in the same walk. Only temp files last written before partial_before
+        (default: now) are removed; newer ones belong to running downloads. Returns
+        (indexed, removed).
+        """
+        started = time.time() if partial_before is None else partial_before
+        with self._lock:
+            self._discarded = set()
+        paths = set()
+        removed = 0
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if not filename.endswith(PARTIAL_SUFFIX):
+                    paths.add(path)
+                    continue
+                try:
+                    if os.path.getmtime(path) < started:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        with self._lock:
+            # Keeps whatever add() recorded while the walk was running, and leaves out
+            # what discard() removed meanwhile (the walk may have seen it before)
+            self._paths |= paths - self._discarded
+            self._discarded = None
+            indexed = len(self._paths)
+        self.ready.set()
+        return indexed, removed
+
+    def load_in_background(self, root):
+        # Downloads that start while the walk runs must keep their temp files
+        started = time.time()
+
+        def run():
+            try:
+                indexed, removed = self.load(root, partial_before=started)
+                print(f"[CACHE] Indexed {indexed} media files, removed {removed} partial downloads.")
+            except Exception as e:
+                print(f"[ERROR] Indexing the media cache failed: {e}")
+        threading.Thread(target=run, daemon=True).start()
+
+    def add(self, path):
+        with self._lock:
+            self._paths.add(path)
+
+    def discard(self, path):
+        with self._lock:
+            self._paths.discard(path)
+            if self._discarded is not None:
+                self._discarded.add(path)
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self._paths
+
+    def __len__(self):
+        with self._lock:
+            return len(self._paths)
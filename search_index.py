@@ -0,0 +1,190 @@
+"""
+Inverted full-text index over the exercise library.
+
+Terms come from the title, category, main/auxiliary muscle groups and equipment names,
+weighted per field. A query token matches terms exactly, by prefix (for search-as-you-
+type) or, from four characters on, within one edit (typos). Every query token has to
+match; documents are ranked by the summed weight of their best matches.
+
+The index is synced against a LibraryIndex: only exercises whose indexed text changed
+are re-tokenised.
+"""
+import re
+import threading
+from bisect import bisect_left
+
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "mainMuscleGroupName": 2.0,
+    "category_name": 1.5,
+    "auxiliary": 1.0,
+    "equipment_name": 1.0,
+}
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.6
+FUZZY_MATCH = 0.35
+FUZZY_MIN_LENGTH = 4
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text or "").lower())
+
+
+def _deletes(term):
+    """The term with each single character removed (symmetric-delete neighbourhood)."""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a, b):
+    """True if a and b differ by at most one insertion, deletion, substitution or adjacent swap."""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diff) == 1:
+            return True
+        return len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+class SearchIndex:
+    """Thread-safe: sync() and search() may be called from several request threads."""
+
+    def __init__(self):
+        self.source = None  # LibraryIndex the index was last synced with
+        self._docs = {}  # exercise id -> indexed field texts
+        self._order = {}  # exercise id -> library position (tie breaker)
+        self._postings = {}  # term -> {exercise id: weight}
+        self._doc_terms = {}  # exercise id -> {term: weight}
+        self._deletes = {}  # deleted variant -> set of terms
+        self._terms = []  # sorted vocabulary, for prefix lookups
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _fields(exercise, derived):
+        """Indexed texts, in FIELD_WEIGHTS order."""
+        return (
+            exercise.get('title') or '',
+            exercise.get('mainMuscleGroupName') or '',
+            exercise.get('category_name') or '',
+            " ".join(a.get('muscleGroupName') or '' for a in exercise.get('auxiliaryMuscleGroupList') or []),
+            derived.equipment_name if derived is not None else '',
+        )
+
+    def sync(self, library_index):
+        """Brings the index in line with a LibraryIndex. Returns (added, updated, removed) counts."""
+        with self._lock:
+            if self.source is library_index:
+                return 0, 0, 0
+            docs = {}
+            order = {}
+            for pos, ex in enumerate(library_index.library):
+                doc_id = ex.get('id')
+                docs[doc_id] = self._fields(ex, library_index.entries.get(doc_id))
+                order[doc_id] = pos
+
+            removed = [doc_id for doc_id in self._docs if doc_id not in docs]
+            added = [doc_id for doc_id in docs if doc_id not in self._docs]
+            updated = [doc_id for doc_id in docs if doc_id in self._docs and self._docs[doc_id] != docs[doc_id]]
+            vocabulary_changed = False
+            for doc_id in removed + updated:
+                vocabulary_changed |= self._remove(doc_id)
+            for doc_id in added + updated:
+                vocabulary_changed |= self._add(doc_id, docs[doc_id])
+            if vocabulary_changed:
+                self._terms = sorted(self._postings)
+            self._order = order
+            self.source = library_index
+            return len(added), len(updated), len(removed)
+
+    def _add(self, doc_id, fields):
+        self._docs[doc_id] = fields
+        terms = {}
+        for weight, text in zip(FIELD_WEIGHTS.values(), fields):
+            for term in tokenize(text):
+                if weight > terms.get(term, 0):
+                    terms[term] = weight
+        self._doc_terms[doc_id] = terms
+        new_terms = False
+        for term, weight in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                new_terms = True
+                if len(term) >= FUZZY_MIN_LENGTH - 1:
+                    for variant in _deletes(term) | {term}:
+                        self._deletes.setdefault(variant, set()).add(term)
+            postings[doc_id] = weight
+        return new_terms
+
+    def _remove(self, doc_id):
+        self._docs.pop(doc_id, None)
+        dropped = False
+        for term in self._doc_terms.pop(doc_id, {}):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                dropped = True
+                for variant in _deletes(term) | {term}:
+                    bucket = self._deletes.get(variant)
+                    if bucket is not None:
+                        bucket.discard(term)
+                        if not bucket:
+                            del self._deletes[variant]
+        return dropped
+
+    def _expand(self, token):
+        """Yields (term, match quality) for the vocabulary terms a query token matches."""
+        matches = {}
+        if token in self._postings:
+            matches[token] = EXACT_MATCH
+        i = bisect_left(self._terms, token)
+        while i < len(self._terms) and self._terms[i].startswith(token):
+            matches.setdefault(self._terms[i], PREFIX_MATCH)
+            i += 1
+        if len(token) >= FUZZY_MIN_LENGTH:
+            for variant in _deletes(token) | {token}:
+                for term in self._deletes.get(variant, ()):
+                    if term not in matches and _within_one_edit(token, term):
+                        matches[term] = FUZZY_MATCH
+        return matches.items()
+
+    def search(self, query, limit=None):
+        """Returns [(exercise id, score)] best first; every query token has to match."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            scores = None
+            for token in dict.fromkeys(tokens):
+                token_scores = {}
+                for term, quality in self._expand(token):
+                    for doc_id, weight in self._postings[term].items():
+                        score = weight * quality
+                        if score > token_scores.get(doc_id, 0):
+                            token_scores[doc_id] = score
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc_id: scores[doc_id] + s for doc_id, s in token_scores.items() if doc_id in scores}
+                if not scores:
+                    return []
+            order = self._order
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], order.get(item[0], 0)))
+        return ranked[:limit] if limit else ranked
+
+    def stats(self):
+        with self._lock:
+            return {"documents": len(self._docs), "terms": len(self._postings)}
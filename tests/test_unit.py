@@ -3,27 +3,55 @@ Unit tests for api_client.py — no real API calls needed.
 All HTTP calls are mocked.
 """
 import json
+import requests
 import sys
 import os
+import threading
+import time
 import unittest
 from unittest.mock import MagicMock, patch
 
 # Make sure the project root is on the path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
-from api_client import SpeedianceClient
+from api_client import SpeedianceClient, RESPONSE_CACHE_POLICIES
+from cache import LRUCache, DiskCache, TieredCache, ResponseCache
+from concurrency import ConcurrencyGovernor, SingleFlight
+from journal import RequestJournal, journal_context
+from library_store import LibraryStore
+from client_pool import ClientPool
+from library_index import LibraryIndex, query_library
+from search_index import SearchIndex
+from delivery import AssetManifest, PrecompressedPayload, negotiate
+from media_cache import MediaCacheIndex, MediaDownloader
 
 
 def _make_client():
     """Return a client with fake credentials so methods don't bail early."""
     client = SpeedianceClient.__new__(SpeedianceClient)
     client.credentials = {"user_id": "test_user", "token": "test_token", "region": "Global", "unit": 0, "custom_instruction": "", "device_type": 1, "allow_monster_moves": False, "owned_accessories": [], "owned_devices": []}
+    client.region = "Global"
     client.host = "api2.speediance.com"
     client.base_url = "https://api2.speediance.com"
-    client.last_debug_info = {}
-    client.library_cache = None
+    client.journal = RequestJournal()
+    client.library_cache_file = "library_cache_v2_device1_allow0.json"
     client.device_type = 1
     client.allow_monster_moves = False
+    client._libraries = {}
+    client._library_indexes = {}
+    client._search_indexes = {}
+    client.library_cache = None
     client.session = MagicMock()
+    client._session_lock = threading.Lock()
+    client._library_lock = threading.Lock()
+    client._config_lock = threading.RLock()
+    client._group_meta = {}
+    client._group_meta_library = None
+    client.detail_cache = TieredCache(LRUCache(64, 3600))
+    client.response_cache = ResponseCache(RESPONSE_CACHE_POLICIES)
+    client.governor = ConcurrencyGovernor()
+    client._inflight = SingleFlight()
+    client.library_store = MagicMock()
+    client.library_store.get_many.return_value = []
     return client
 
 
@@ -256,6 +284,1241 @@ class TestSaveWorkoutWeights(unittest.TestCase):
             self.assertEqual(action['templatePresetId'], preset_id, f"preset_id={preset_id} not preserved")
 
 
+class TestGroupMetaIndex(unittest.TestCase):
+
+    def _capture_post(self, client):
+        captured = {}
+
+        def fake_request(method, url, **kwargs):
+            captured['method'] = method
+            captured['payload'] = kwargs.get('json', {})
+            return _mock_save_response()
+
+        client._request = MagicMock(side_effect=fake_request)
+        return captured
+
+    def _exercise(self, group_id):
+        return {'groupId': group_id, 'preset_id': -1,
+                'sets': [{'reps': 10, 'weight': 10, 'mode': 1, 'rest': 60, 'unit': 'reps'}] * 2}
+
+    def test_library_cache_answers_without_extra_requests(self):
+        client = _make_client()
+        client.library_cache = [
+            {"id": 5, "isLeftRight": 1, "actionLibraryList": [{"id": 5005}]},
+            {"id": 6, "isLeftRight": 0, "actionLibraryList": [{"id": 6006}]},
+        ]
+        client.get_batch_details = MagicMock()
+        client.is_exercise_unilateral = MagicMock()
+        captured = self._capture_post(client)
+
+        client.save_workout("W", [self._exercise(5), self._exercise(6)])
+
+        client.get_batch_details.assert_not_called()
+        client.is_exercise_unilateral.assert_not_called()
+        self.assertEqual(client._request.call_count, 1)
+        actions = captured['payload']['actionLibraryList']
+        self.assertEqual([a['actionLibraryId'] for a in actions], [5005, 6006])
+        self.assertEqual([a['leftRight'] for a in actions], ['1,2', '0,0'])
+
+    def test_missing_groups_fetched_in_one_batch(self):
+        client = _make_client()
+        client.library_cache = [{"id": 5, "isLeftRight": 0, "actionLibraryList": [{"id": 5005}]}]
+        client.get_batch_details = MagicMock(return_value=[
+            {"id": 7, "isLeftRight": 1, "actionLibraryList": [{"id": 7007}]},
+            {"id": 8, "isLeftRight": 0, "actionLibraryList": [{"id": 8008}]},
+        ])
+        client.is_exercise_unilateral = MagicMock()
+        self._capture_post(client)
+
+        meta = client.resolve_group_meta([5, 7, '8'])
+
+        client.get_batch_details.assert_called_once_with([7, 8])
+        client.is_exercise_unilateral.assert_not_called()
+        self.assertEqual(meta[7], {"variant_id": 7007, "is_unilateral": True})
+        self.assertEqual(meta[8]["variant_id"], 8008)
+
+
+class TestExerciseDetailCache(unittest.TestCase):
+
+    def test_second_lookup_is_served_from_memory(self):
+        client = _make_client()
+        client._request = MagicMock(return_value=_make_detail_response(3, 3003))
+        first = client.get_exercise_detail(3)
+        first['steps'] = []  # callers mutate the result; the cache must not see it
+        second = client.get_exercise_detail('3')
+        self.assertEqual(client._request.call_count, 1)
+        self.assertNotIn('steps', second)
+        stats = client.cache_stats()['exercise_detail']
+        self.assertEqual((stats['memory_hits'], stats['misses']), (1, 1))
+
+    def test_refresh_bypasses_cache(self):
+        client = _make_client()
+        client._request = MagicMock(return_value=_make_detail_response(3, 3003))
+        client.get_exercise_detail(3)
+        client.get_exercise_detail(3, refresh=True)
+        self.assertEqual(client._request.call_count, 2)
+
+    def test_batch_summaries_do_not_shadow_details(self):
+        """List responses lack isLeftRight and presets, so the detail endpoint is still asked."""
+        client = _make_client()
+        client.library_cache = None
+        client._request = MagicMock(side_effect=[_make_batch_response([4, 5]), _make_detail_response(5, 1005, True)])
+        meta = client.resolve_group_meta([5])
+        self.assertEqual(meta[5], {"variant_id": 1005, "is_unilateral": True})
+        self.assertEqual(client._request.call_count, 2)
+        self.assertEqual(client.get_exercise_detail(5)['isLeftRight'], 1)
+        self.assertEqual(client._request.call_count, 2)
+
+    def test_unilateral_flags_are_fetched_in_one_wave(self):
+        """A cold template costs one batch request plus one concurrent detail request per group."""
+        client = _make_client()
+        client.library_cache = None
+        ids = [11, 12, 13]
+        barrier = threading.Barrier(len(ids), timeout=2)
+
+        def respond(method, url, **kwargs):
+            if "/list?" in url:
+                return _make_batch_response(ids)
+            gid = int(url.rsplit("/", 1)[1].split("?")[0])
+            barrier.wait()  # only passes if all detail requests are in flight together
+            return _make_detail_response(gid, gid + 1000, is_unilateral=gid == 12)
+
+        client._request = MagicMock(side_effect=respond)
+        meta = client.resolve_group_meta(ids)
+        self.assertEqual(client._request.call_count, 1 + len(ids))
+        self.assertEqual({gid: m["is_unilateral"] for gid, m in meta.items()}, {11: False, 12: True, 13: False})
+        self.assertEqual(meta[11]["variant_id"], 1011)
+        client.resolve_group_meta(ids)
+        self.assertEqual(client._request.call_count, 1 + len(ids))
+
+    def test_entries_are_per_account(self):
+        """Details carry per-user fields (recommendedWeight); accounts must not see each other's."""
+        client = _make_client()
+        client._request = MagicMock(return_value=_make_detail_response(3, 3003))
+        client.get_exercise_detail(3)
+        client.credentials = dict(client.credentials, user_id="someone-else")
+        client.get_exercise_detail(3)
+        self.assertEqual(client._request.call_count, 2)
+
+    def test_prefix_invalidation_covers_every_account(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = TieredCache(LRUCache(8, 60), DiskCache(tmp, ttl=60))
+            for key in ("12.a", "12.b", "123.a"):
+                cache.set(key, {"k": key})
+            cache.invalidate_prefixes(["12."])
+            self.assertIsNone(cache.get("12.a"))
+            self.assertIsNone(cache.get("12.b"))
+            self.assertEqual(cache.get("123.a"), {"k": "123.a"})
+            self.assertEqual(sorted(os.listdir(tmp)), ["123.a.json"])
+
+    def test_disk_tier_survives_new_memory_and_expires(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            disk = DiskCache(tmp, ttl=60)
+            TieredCache(LRUCache(4, 60), disk).set("9", {"id": 9})
+            fresh = TieredCache(LRUCache(4, 60), disk)
+            self.assertEqual(fresh.get("9"), {"id": 9})
+            self.assertEqual(fresh.stats()['disk_hits'], 1)
+            disk.set("10", {"id": 10}, ttl=-1)
+            self.assertIsNone(fresh.get("10"))
+            self.assertFalse(os.path.exists(os.path.join(tmp, "10.json")))
+
+    def test_lru_evicts_oldest(self):
+        lru = LRUCache(max_entries=2, ttl=60)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        evicted = lru.set("c", 3)
+        self.assertEqual([e[0] for e in evicted], ["b"])
+        self.assertIn("a", lru)
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def _client_with_upstream(self):
+        client = _make_client()
+        counter = {"n": 0}
+
+        def fake_session_request(method, url, **kwargs):
+            counter["n"] += 1
+            resp = MagicMock()
+            resp.status_code = 200
+            resp.json.return_value = {"code": 0, "data": [{"id": counter["n"], "name": "Bench"}]}
+            resp.headers = {"Content-Type": "application/json"}
+            resp.content = json.dumps(resp.json.return_value).encode()
+            return resp
+
+        client.session.request.side_effect = fake_session_request
+        return client, counter
+
+    def test_accessories_served_from_cache(self):
+        client, counter = self._client_with_upstream()
+        first = client.get_accessories()
+        second = client.get_accessories()
+        self.assertEqual(counter["n"], 1)
+        self.assertEqual(first, second)
+        self.assertEqual(client.cache_stats()["responses"]["accessories"]["hits"], 1)
+
+    def test_bypass_header_and_context_refresh(self):
+        client, counter = self._client_with_upstream()
+        client.get_accessories()
+        headers = client._get_headers()
+        headers["X-Cache-Bypass"] = "1"
+        resp = client._request('GET', f"{client.base_url}/api/app/accessories/list", headers=headers)
+        self.assertEqual(resp.json()["data"][0]["id"], 2)
+        self.assertNotIn("X-Cache-Bypass", client.session.request.call_args.kwargs["headers"])
+        with client.bypass_cache():
+            client.get_accessories()
+        self.assertEqual(counter["n"], 3)
+        # The refreshed response replaced the cached one
+        self.assertEqual(client.get_accessories()[0]["id"], 3)
+
+    def test_vary_on_user_and_invalidation(self):
+        client, counter = self._client_with_upstream()
+        client.get_course_detail(1)
+        client.credentials = dict(client.credentials, user_id="other_user")
+        client.get_course_detail(1)
+        self.assertEqual(counter["n"], 2)
+        client.invalidate_response_cache("course_detail")
+        client.get_course_detail(1)
+        self.assertEqual(counter["n"], 3)
+
+    def test_non_cacheable_endpoints_always_hit_upstream(self):
+        client, counter = self._client_with_upstream()
+        client.get_calendar_month("2026-01")
+        client.get_calendar_month("2026-01")
+        self.assertEqual(counter["n"], 2)
+
+    def test_sqlite_spill_receives_evicted_entries(self):
+        import tempfile
+        policies = {"p": {"path": "/p", "ttl": 60, "max_entries": 1, "vary": ()}}
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ResponseCache(policies, os.path.join(tmp, "spill.db"))
+            cache.set("p", "a", (200, {"X": "1"}, b"first"))
+            cache.set("p", "b", (200, {}, b"second"))  # evicts "a" to SQLite
+            self.assertEqual(cache.get("p", "a"), (200, {"X": "1"}, b"first"))
+            self.assertEqual(cache.stats()["spill_hits"], 1)
+            cache.invalidate("p")
+            self.assertIsNone(cache.get("p", "b"))
+
+
+class TestConcurrentCalls(unittest.TestCase):
+
+    def test_gather_runs_concurrently_and_keeps_order(self):
+        client = _make_client()
+
+        def slow(value, delay):
+            time.sleep(delay)
+            return value
+
+        started = time.monotonic()
+        results = client.gather((slow, "a", 0.1), (slow, "b", 0.1), (slow, "c", 0.01))
+        self.assertEqual(results, ["a", "b", "c"])
+        self.assertLess(time.monotonic() - started, 0.19)
+
+    def test_gather_reraises_unauthorized(self):
+        client = _make_client()
+
+        def fail():
+            raise Exception("Unauthorized")
+
+        with self.assertRaises(Exception) as ctx:
+            client.gather((fail,), (lambda: 1,))
+        self.assertEqual(str(ctx.exception), "Unauthorized")
+
+    def test_concurrent_config_saves_stay_consistent(self):
+        import tempfile
+        client = _make_client()
+        with tempfile.TemporaryDirectory() as tmp:
+            client.config_file = os.path.join(tmp, "config.json")
+
+            def save(i):
+                client.save_config(f"user{i}", f"token{i}", "Global", device_type=1)
+
+            threads = [threading.Thread(target=save, args=(i,)) for i in range(16)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            creds = client.credentials
+            self.assertEqual(creds["token"], "token" + creds["user_id"][4:])
+            with open(client.config_file) as f:
+                self.assertEqual(json.load(f), creds)
+
+
+class TestConcurrencyGovernor(unittest.TestCase):
+
+    def test_additive_increase_when_healthy(self):
+        gov = ConcurrencyGovernor(initial=2, maximum=4)
+        for _ in range(2):
+            gov.record(0.05, 200)
+        self.assertEqual(gov.limit, 3)
+        for _ in range(20):
+            gov.record(0.05, 200)
+        self.assertEqual(gov.limit, 4)
+
+    def test_multiplicative_decrease_on_429_once_per_burst(self):
+        gov = ConcurrencyGovernor(initial=8)
+        for _ in range(5):
+            gov.record(0.05, 429)
+        self.assertEqual(gov.limit, 4)
+        self.assertEqual(gov.snapshot()["throttle_events"], 1)
+
+    def test_backs_off_when_p95_rises(self):
+        gov = ConcurrencyGovernor(initial=8, maximum=8, window=10)
+        for _ in range(10):
+            gov.record(0.05, 200)
+        for _ in range(10):
+            gov.record(0.5, 200)
+        self.assertEqual(gov.limit, 4)
+        self.assertEqual(gov.snapshot()["last_throttle"]["reason"], "p95 latency rising")
+
+    def test_limit_caps_in_flight_requests(self):
+        gov = ConcurrencyGovernor(initial=2, maximum=2)
+        peak = {"now": 0, "max": 0}
+        lock = threading.Lock()
+
+        def work():
+            with gov.slot():
+                with lock:
+                    peak["now"] += 1
+                    peak["max"] = max(peak["max"], peak["now"])
+                time.sleep(0.02)
+                with lock:
+                    peak["now"] -= 1
+
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        self.assertEqual(peak["max"], 2)
+
+    def test_request_feeds_governor(self):
+        client = _make_client()
+        resp = _json_response([])
+        resp.status_code = 503
+        client.session.request.return_value = resp
+        client._request('GET', 'https://api2.speediance.com/x')
+        self.assertEqual(client.governor.snapshot()["throttle_events"], 1)
+
+
+class TestRequestJournal(unittest.TestCase):
+
+    def _client_returning(self, body):
+        client = _make_client()
+        resp = MagicMock()
+        resp.status_code = 200
+        resp.content = json.dumps(body).encode()
+        resp.json.return_value = body
+        resp.request.headers = {"Token": "secret", "Host": "api2.speediance.com"}
+        client.session.request.return_value = resp
+        return client, resp
+
+    def test_body_parsed_once(self):
+        client, resp = self._client_returning({"code": 0, "data": [1]})
+        original_json = resp.json
+        result = client._request('GET', 'https://api2.speediance.com/x')
+        self.assertEqual(result.json(), {"code": 0, "data": [1]})
+        result.json()
+        self.assertEqual(original_json.call_count, 1)
+
+    def test_entries_redacted_and_filtered_by_request_id(self):
+        client, _ = self._client_returning({"code": 0, "data": {"token": "abc", "name": "n"}})
+        token = journal_context.set("req-1")
+        try:
+            client._request('POST', 'https://api2.speediance.com/login', json={"password": "pw"})
+        finally:
+            journal_context.reset(token)
+        client._request('GET', 'https://api2.speediance.com/other')
+
+        entries = client.journal.entries(request_id="req-1")
+        self.assertEqual(len(entries), 1)
+        entry = entries[0]
+        self.assertEqual(entry["request_headers"]["Token"], "***")
+        self.assertEqual(entry["request_body"], {"password": "***"})
+        self.assertEqual(entry["response_body"]["data"], {"token": "***", "name": "n"})
+        self.assertEqual(client.last_debug_info["url"], 'https://api2.speediance.com/other')
+
+    def test_ring_buffer_and_sampling_off(self):
+        journal = RequestJournal(capacity=3)
+        for i in range(5):
+            journal.record('GET', f'u{i}', status=200, response_content=b'{}')
+        self.assertEqual([e["url"] for e in journal.entries()], ['u4', 'u3', 'u2'])
+        off = RequestJournal(sample_rate=0)
+        off.record('GET', 'u', error="boom")
+        self.assertEqual(off.latest(), {})
+
+    def test_large_body_truncated(self):
+        journal = RequestJournal(body_limit=10)
+        journal.record('GET', 'u', status=200, response_content=b'{"data": "' + b'x' * 100 + b'"}')
+        self.assertTrue(journal.latest()["response_body"].endswith("..."))
+        # Only body_limit bytes are kept in the ring buffer
+        self.assertEqual(len(journal._entries[-1].response_content), 10)
+
+    def test_fan_out_keeps_request_context(self):
+        client = _make_client()
+        client.session.request.return_value = _json_response([])
+        client.session.request.return_value.content = b'{}'
+        token = journal_context.set("page")
+        try:
+            client.gather((client.get_calendar_month, "2026-01"), (client.get_calendar_month, "2026-02"))
+        finally:
+            journal_context.reset(token)
+        self.assertEqual(len(client.journal.entries(request_id="page")), 2)
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def _run_concurrently(self, func, n=4):
+        results = [None] * n
+        barrier = threading.Barrier(n)
+
+        def run(i):
+            barrier.wait()
+            results[i] = func()
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        return results
+
+    def test_identical_gets_share_one_request(self):
+        client = _make_client()
+
+        def slow_request(method, url, **kwargs):
+            time.sleep(0.1)
+            resp = _json_response({"code": "ABC"})
+            resp.headers = {}
+            resp.content = b'{"code": 0, "data": {"code": "ABC"}}'
+            return resp
+
+        client.session.request.side_effect = slow_request
+        results = self._run_concurrently(lambda: client.get_workout_detail("ABC"))
+        self.assertEqual(client.session.request.call_count, 1)
+        self.assertTrue(all(r == {"code": "ABC"} for r in results))
+        # Each caller owns its result
+        self.assertEqual(len({id(r) for r in results}), 4)
+        self.assertEqual(client.concurrency_stats()["single_flight"]["coalesced"], 3)
+
+    def test_concurrent_library_builds_coalesce(self):
+        client = _make_client()
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.1)
+            client.library_cache = [{"id": 1}]
+            return client.library_cache
+
+        client._build_library = build
+        results = self._run_concurrently(client.get_library)
+        self.assertEqual(len(builds), 1)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def test_errors_propagate_to_joiners(self):
+        flight = SingleFlight()
+        gate = threading.Event()
+
+        def fail():
+            gate.wait()
+            raise Exception("Unauthorized")
+
+        errors = []
+
+        def call():
+            try:
+                flight.do("k", fail)
+            except Exception as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for th in threads:
+            th.start()
+        time.sleep(0.05)
+        gate.set()
+        for th in threads:
+            th.join()
+        self.assertEqual(errors, ["Unauthorized"] * 3)
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def test_request_uses_pooled_session(self):
+        client = _make_client()
+        client.session.request.return_value = _mock_save_response()
+        client._request('GET', 'https://api2.speediance.com/x')
+        client.session.request.assert_called_once_with('GET', 'https://api2.speediance.com/x')
+
+    def test_region_switch_rebuilds_session(self):
+        client = _make_client()
+        old_session = client.session
+        with patch.object(SpeedianceClient, 'preconnect') as preconnect:
+            client.set_region("EU")
+        self.assertEqual(client.base_url, "https://euapi.speediance.com")
+        self.assertIsNot(client.session, old_session)
+        old_session.close.assert_called_once()
+        preconnect.assert_called_once()
+
+    def test_pool_holds_every_connection_the_governor_allows(self):
+        from api_client import SharedResources
+        adapter = _make_client()._build_session().get_adapter("https://api2.speediance.com")
+        self.assertGreaterEqual(adapter._pool_maxsize, SharedResources().governor.maximum)
+
+    def test_same_region_keeps_session(self):
+        client = _make_client()
+        old_session = client.session
+        with patch.object(SpeedianceClient, 'preconnect') as preconnect:
+            client.set_region("Global")
+        self.assertIs(client.session, old_session)
+        preconnect.assert_not_called()
+
+
+def _json_response(data, status=200):
+    resp = MagicMock()
+    resp.status_code = status
+    resp.json.return_value = {"code": 0, "data": data}
+    return resp
+
+
+def _ids_from_url(url):
+    return [int(part[4:]) for part in url.split('?', 1)[1].split('&') if part.startswith('ids=')]
+
+
+class TestLibraryFanOut(unittest.TestCase):
+
+    def test_tabs_merge_in_category_order(self):
+        """Slow early tabs must not change 'first occurrence wins' deduplication."""
+        client = _make_client()
+        client._save_library_cache = MagicMock()
+        client.get_categories = MagicMock(return_value=[
+            {"id": 1, "name": "Chest"}, {"id": 2, "name": "Arms"}, {"id": 3, "name": "Back"},
+        ])
+        tab_groups = {1: [11, 99], 2: [22, 99], 3: [33]}
+
+        def fake_request(method, url, **kwargs):
+            if 'trainingPartGroup' in url:
+                tab_id = int(url.split('tabId=')[1].split('&')[0])
+                # Earlier tabs answer last
+                time.sleep(0.03 * (4 - tab_id))
+                return _json_response([{"actionLibraryGroupList": [{"id": gid} for gid in tab_groups[tab_id]]}])
+            return _json_response([{"id": gid} for gid in _ids_from_url(url)])
+
+        client._request = MagicMock(side_effect=fake_request)
+
+        library = client.get_library()
+        self.assertEqual([ex['id'] for ex in library], [11, 99, 22, 33])
+        self.assertEqual(library[1]['category_name'], "Chest")
+
+
+class TestLibraryDeltaSync(unittest.TestCase):
+
+    def _client(self, listing, failing_tabs=()):
+        client = _make_client()
+        client._save_library_cache = MagicMock()
+        client.get_categories = MagicMock(return_value=[{"id": 1, "name": "Chest"}, {"id": 2, "name": "Back"}])
+        detail_calls = []
+
+        def fake_request(method, url, **kwargs):
+            if 'trainingPartGroup' in url:
+                tab_id = int(url.split('tabId=')[1].split('&')[0])
+                if tab_id in failing_tabs:
+                    raise Exception("timeout")
+                return _json_response([{"actionLibraryGroupList": listing[tab_id]}])
+            ids = _ids_from_url(url)
+            detail_calls.append(ids)
+            return _json_response([{"id": gid, "title": f"new {gid}"} for gid in ids])
+
+        client._request = MagicMock(side_effect=fake_request)
+        return client, detail_calls
+
+    def test_only_new_and_changed_groups_are_fetched(self):
+        client, detail_calls = self._client({
+            1: [{"id": 1, "title": "Press v2"}, {"id": 2, "title": "Fly"}],
+            2: [{"id": 4, "title": "Row"}],
+        })
+        client.library_cache = [
+            {"id": 1, "title": "Press", "category_id": 1},
+            {"id": 2, "title": "Fly", "category_id": 1},
+            {"id": 3, "title": "Old", "category_id": 2},
+        ]
+        summary = client.sync_library()
+        self.assertEqual(sorted(sum(detail_calls, [])), [1, 4])
+        self.assertEqual((summary["added"], summary["updated"], summary["removed"]), ([4], [1], [3]))
+        self.assertEqual(summary["unchanged"], 1)
+        self.assertEqual([ex['id'] for ex in client.library_cache], [1, 2, 4])
+        self.assertEqual(client.library_cache[2]['category_name'], "Back")
+        client._save_library_cache.assert_called_once()
+
+    def test_no_changes_means_no_detail_requests(self):
+        client, detail_calls = self._client({1: [{"id": 1, "title": "Press"}], 2: []})
+        client.library_cache = [{"id": 1, "title": "Press", "category_id": 1, "category_name": "Chest",
+                                 "device_type_tag": "1"}]
+        summary = client.sync_library()
+        self.assertEqual(detail_calls, [])
+        self.assertEqual(summary["unchanged"], 1)
+        client._save_library_cache.assert_not_called()
+
+    def test_failed_tab_does_not_prune(self):
+        client, _ = self._client({1: [{"id": 1, "title": "Press"}], 2: []}, failing_tabs=(2,))
+        client.library_cache = [{"id": 1, "title": "Press"}, {"id": 3, "title": "Row"}]
+        summary = client.sync_library()
+        self.assertEqual(summary["removed"], [])
+        self.assertEqual([ex['id'] for ex in client.library_cache], [1, 3])
+
+
+class TestLibraryStore(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self._tmp = tempfile.TemporaryDirectory()
+        self.store = LibraryStore(os.path.join(self._tmp.name, "library.db"))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _library(self):
+        return [
+            {"id": 2, "title": "Row", "accessories": "5,7", "category_id": 10, "category_name": "Back",
+             "device_type_list": [1, 2], "device_type_tag": "1,2", "equipment_name": "Bar"},
+            {"id": 1, "title": "Press", "accessories": "", "category_id": 11, "category_name": "Chest",
+             "device_type_list": [2], "device_type_tag": "2"},
+        ]
+
+    def test_round_trip_keeps_order_and_tags(self):
+        self.store.replace("device2_allow1", self._library())
+        loaded = self.store.load("device2_allow1")
+        self.assertEqual([ex['id'] for ex in loaded], [2, 1])
+        self.assertEqual(loaded[0]['device_type_list'], [1, 2])
+        self.assertEqual(loaded[0]['device_type_tag'], "1,2")
+        self.assertNotIn('equipment_name', loaded[0])
+        self.assertIsNone(self.store.load("device1_allow0"))
+
+    def test_get_many_reads_only_the_given_ids(self):
+        self.store.replace("device2_allow1", self._library())
+        rows = self.store.get_many("device2_allow1", [1, 99])
+        self.assertEqual([ex['title'] for ex in rows], ["Press"])
+        self.assertEqual(rows[0]['device_type_list'], [2])
+        self.assertEqual(self.store.get_many("device2_allow1", []), [])
+
+    def test_variants_share_rows_and_delta_prunes(self):
+        library = self._library()
+        self.store.replace("device2_allow1", library)
+        self.store.replace("device1_allow0", [dict(library[0], category_name="Pull")])
+        self.assertEqual(self.store.get_many("device1_allow0", [2])[0]['category_name'], "Pull")
+        self.assertEqual(self.store.get_many("device2_allow1", [2])[0]['category_name'], "Back")
+
+        changed = dict(library[1], title="Press v2")
+        self.store.apply_delta("device2_allow1", [changed], changed_ids=[1], removed_ids=[2])
+        self.assertEqual([ex['title'] for ex in self.store.load("device2_allow1")], ["Press v2"])
+        # Still referenced by the other variant
+        self.assertEqual(len(self.store.get_many("device1_allow0", [2])), 1)
+        self.store.delete_variant("device1_allow0")
+        self.assertIsNone(self.store.load("device1_allow0"))
+        self.store.replace("device1_allow0", [])
+        self.assertEqual(self.store.get_many("device1_allow0", [2]), [])
+
+    def test_client_reads_library_lazily_once(self):
+        from api_client import _NOT_LOADED
+        client = _make_client()
+        client.library_store = MagicMock()
+        client.library_store.load.return_value = [{"id": 1, "isLeftRight": 1, "actionLibraryList": [{"id": 11}]}]
+        client.library_store.get_many.return_value = []
+        client.library_cache = _NOT_LOADED
+
+        # Lookups that the store can answer do not force the full load
+        client.resolve_group_meta([])
+        client.library_store.load.assert_not_called()
+
+        self.assertEqual(client.library_cache[0]['id'], 1)
+        self.assertEqual(client.library_cache[0]['id'], 1)
+        client.library_store.load.assert_called_once()
+
+
+class TestSettingsStore(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self._tmp = tempfile.TemporaryDirectory()
+        self.client = _make_client()
+        self.client.config_file = os.path.join(self._tmp.name, "config.json")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_single_field_update_persists_atomically(self):
+        before = self.client.credentials
+        self.client.update_settings(custom_instruction="More legs")
+        self.assertEqual(self.client.credentials, dict(before, custom_instruction="More legs"))
+        self.assertEqual(before["custom_instruction"], "")  # old snapshot untouched
+        with open(self.client.config_file) as f:
+            self.assertEqual(json.load(f), self.client.credentials)
+        self.assertEqual(os.listdir(self._tmp.name), ["config.json"])
+
+    def test_library_variant_changes_only_with_device_settings(self):
+        self.client.library_cache = [{"id": 1}]
+        self.client.update_settings(unit="1", owned_accessories=[3])
+        self.assertEqual(self.client.credentials["unit"], 1)
+        self.assertEqual(self.client.library_cache, [{"id": 1}])
+        self.client.library_store.load.return_value = None
+        self.client.update_settings(device_type=2, allow_monster_moves=1)
+        self.assertEqual(self.client.library_variant, "device2_allow1")
+        self.assertEqual(self.client.library_cache_file, "library_cache_v2_device2_allow1.json")
+
+    def test_unchanged_and_unknown_settings(self):
+        with patch.object(self.client, '_persist_config') as persist:
+            self.client.update_settings(unit=0)
+            persist.assert_not_called()
+        with self.assertRaises(ValueError):
+            self.client.update_settings(colour="red")
+
+
+class TestLibraryIndex(unittest.TestCase):
+
+    LIBRARY = [
+        {"id": 1, "accessories": "3,40", "category_id": 2, "device_type_list": [1, 2], "device_type_tag": "1,2"},
+        {"id": 2, "accessories": "", "category_id": 18, "device_type": 2},
+        {"id": 3, "accessories": None, "category_id": 2, "device_type_list": [1]},
+    ]
+    ACCESSORIES = [{"id": 3, "name": "Bar"}, {"id": 11, "name": "Pilates Loops"}]
+
+    def test_derived_fields(self):
+        index = LibraryIndex(self.LIBRARY, self.ACCESSORIES)
+        self.assertEqual(index.get(1).equipment_name, "Bar, Standard")
+        self.assertEqual(index.get(2).equipment_name, "Standard")
+        self.assertEqual(index.get(1).device_tag, "1,2")
+        self.assertEqual(index.get(2).device_tag, "2")
+        self.assertEqual(index.get(3).accessory_mask, 0)
+        self.assertNotIn('equipment_name', self.LIBRARY[0])
+
+    def test_owned_filter_is_a_mask_check(self):
+        index = LibraryIndex(self.LIBRARY, self.ACCESSORIES)
+        bar_only = index.mask([3])
+        self.assertFalse(index.usable_with(self.LIBRARY[0], bar_only))
+        self.assertTrue(index.usable_with(self.LIBRARY[0], index.mask([3, 40])))
+        # Pilates needs loops or straps even though the exercise lists nothing
+        self.assertFalse(index.usable_with(self.LIBRARY[1], bar_only))
+        self.assertTrue(index.usable_with(self.LIBRARY[1], index.mask([11])))
+
+    def test_client_rebuilds_only_when_inputs_change(self):
+        client = _make_client()
+        library = [dict(ex) for ex in self.LIBRARY]
+        first = client.get_library_index(library, self.ACCESSORIES)
+        self.assertIs(client.get_library_index(library, list(self.ACCESSORIES)), first)
+        self.assertIsNot(client.get_library_index(list(library), self.ACCESSORIES), first)
+
+
+class TestLibraryQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.library = [
+            {"id": i, "title": f"Move {chr(ord('Z') - i)}", "category_id": 1 + i % 2, "trainingPartId2": 11 + i % 3,
+             "accessories": "3" if i % 4 == 0 else "", "device_type_list": [1] if i < 5 else [1, 2]}
+            for i in range(10)
+        ]
+        self.index = LibraryIndex(self.library, [{"id": 3, "name": "Bar"}])
+
+    def test_cursor_pages_cover_everything_once(self):
+        seen, cursor = [], None
+        while True:
+            page = query_library(self.index, sort="title", cursor=cursor, limit=3)
+            seen.extend(item["id"] for item in page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, list(range(9, -1, -1)))
+        self.assertEqual(page["total"], 10)
+
+    def test_filters_and_projection(self):
+        result = query_library(self.index, category_ids=[1], device_type=2, fields=["id", "equipment_name"])
+        self.assertEqual(result["items"], [{"id": 6, "equipment_name": "Standard"}, {"id": 8, "equipment_name": "Bar"}])
+        owned_nothing = query_library(self.index, owned_mask=0, sort="-id")
+        self.assertEqual([item["id"] for item in owned_nothing["items"]], [9, 7, 6, 5, 3, 2, 1])
+        self.assertEqual(owned_nothing["equipment_hidden"], 3)
+        self.assertEqual(query_library(self.index, muscle=13)["total"], 3)
+
+    def test_invalid_sort_or_cursor(self):
+        cursor = query_library(self.index, limit=1)["next_cursor"]
+        with self.assertRaises(ValueError):
+            query_library(self.index, sort="title", cursor=cursor)
+        with self.assertRaises(ValueError):
+            query_library(self.index, sort="popularity")
+        with self.assertRaises(ValueError):
+            query_library(self.index, cursor="not-a-cursor")
+        # Well-formed cursors whose key has the wrong shape or types
+        from library_index import encode_cursor
+        for sort, key in (("title", [3, "x"]), ("position", ["1"]), ("id", [1, 2]), ("id", [True])):
+            with self.assertRaises(ValueError):
+                query_library(self.index, sort=sort, cursor=encode_cursor(sort, key))
+
+
+class TestLibraryPayload(unittest.TestCase):
+
+    def test_payload_has_every_field_create_html_reads(self):
+        """fullLibrary in create.html is the versioned payload; a trimmed field breaks it silently."""
+        import re
+        from library_index import PAYLOAD_FIELDS
+        with open(os.path.join(os.path.dirname(__file__), '..', 'templates', 'create.html'), encoding='utf-8') as f:
+            html = f.read()
+        prompt_loop = re.search(r"fullLibrary\.forEach\(ex => \{(.*?)\n        \}\);", html, re.S).group(1)
+        used = set(re.findall(r"\bex\.(\w+)", prompt_loop))
+        used |= set(re.findall(r"\blibEx\.(\w+)", html))
+        used |= set(re.findall(r"fullLibrary\.find\(e => e\.(\w+)", html))
+        self.assertTrue(used)
+        self.assertEqual(used - set(PAYLOAD_FIELDS), set())
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    LIBRARY = [
+        {"id": 1, "title": "Barbell Bench Press", "mainMuscleGroupName": "Chest", "category_name": "Strength", "accessories": "3"},
+        {"id": 2, "title": "Incline Dumbbell Press", "mainMuscleGroupName": "Chest",
+         "auxiliaryMuscleGroupList": [{"muscleGroupName": "Triceps"}]},
+        {"id": 3, "title": "Seated Row", "mainMuscleGroupName": "Back", "category_name": "Strength"},
+    ]
+
+    def _index(self, library):
+        return LibraryIndex(library, [{"id": 3, "name": "Long Bar"}])
+
+    def test_prefix_typo_and_ranking(self):
+        search = SearchIndex()
+        search.sync(self._index(self.LIBRARY))
+        self.assertEqual([doc for doc, _ in search.search("ben")], [1])
+        self.assertEqual([doc for doc, _ in search.search("benhc pres")], [1])
+        self.assertEqual([doc for doc, _ in search.search("tricep")], [2])
+        self.assertEqual([doc for doc, _ in search.search("long bar")], [1])
+        # Title matches outrank category matches
+        self.assertEqual([doc for doc, _ in search.search("row strength")], [3])
+        self.assertEqual(search.search("press squat"), [])
+
+    def test_sync_only_reindexes_changes(self):
+        search = SearchIndex()
+        search.sync(self._index(self.LIBRARY))
+        changed = [dict(self.LIBRARY[0]), dict(self.LIBRARY[1], title="Decline Dumbbell Press")]
+        self.assertEqual(search.sync(self._index(changed)), (0, 1, 1))
+        self.assertEqual(search.search("row"), [])
+        self.assertEqual([doc for doc, _ in search.search("declin")], [2])
+        self.assertEqual(search.search("incline"), [])
+        self.assertEqual(search.stats()["documents"], 2)
+
+
+class TestDelivery(unittest.TestCase):
+
+    def test_negotiation_honours_q_values(self):
+        self.assertEqual(negotiate("gzip, deflate, br", ("br", "gzip")), "br")
+        self.assertEqual(negotiate("gzip, br;q=0", ("br", "gzip")), "gzip")
+        self.assertEqual(negotiate("gzip", ("br",)), None)
+        self.assertEqual(negotiate("*", ("gzip",)), "gzip")
+        self.assertEqual(negotiate(None, ("gzip",)), None)
+
+    def test_payload_version_follows_content(self):
+        import gzip
+        body = json.dumps([{"id": 1, "title": "Squat"}] * 50).encode()
+        payload = PrecompressedPayload(body)
+        self.assertEqual(payload.version, PrecompressedPayload(bytes(body)).version)
+        self.assertNotEqual(payload.version, PrecompressedPayload(body + b" ").version)
+        encoding, data = payload.select("gzip")
+        self.assertEqual(encoding, "gzip")
+        self.assertEqual(gzip.decompress(data), body)
+        self.assertEqual(payload.select("identity"), (None, body))
+
+    def test_asset_manifest_fingerprints_and_precompresses(self):
+        import gzip
+        import tempfile
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, "media_cache"))
+            with open(os.path.join(root, "app.js"), "w") as f:
+                f.write("console.log('hi');" * 100)
+            with open(os.path.join(root, "media_cache", "clip.mp4"), "wb") as f:
+                f.write(b"video")
+            manifest = AssetManifest(root)
+            self.assertEqual(manifest.build(), 1)
+            name = manifest.url_path("app.js")
+            self.assertRegex(name, r"^app\.[0-9a-f]{16}\.js$")
+            rel_path, version, siblings = manifest.resolve(name)
+            self.assertEqual(rel_path, "app.js")
+            with open(siblings["gzip"], "rb") as f:
+                self.assertEqual(gzip.decompress(f.read()), b"console.log('hi');" * 100)
+            self.assertIsNone(manifest.resolve("app.0000000000000000.js"))
+            self.assertIsNone(manifest.url_path("media_cache/clip.mp4"))
+
+            background = AssetManifest(root)
+            self.assertIsNone(background.url_path("app.js"))  # plain /static URL until built
+            background.build_in_background()
+            self.assertTrue(background.ready.wait(5))
+            self.assertEqual(background.url_path("app.js"), name)
+
+
+def _import_app():
+    """app.py builds its module-level state on import; import it only for the route tests."""
+    import app as app_module
+    return app_module
+
+
+class TestAppImport(unittest.TestCase):
+
+    def test_import_has_no_startup_side_effects(self):
+        """Filesystem work waits for start_background_work(), which only the serving process runs."""
+        app_module = _import_app()
+        self.assertIsNone(app_module.app.jinja_env.bytecode_cache)
+        self.assertFalse(app_module.static_assets.ready.is_set())
+        self.assertFalse(app_module.media_index.ready.is_set())
+
+
+class TestResponseCompression(unittest.TestCase):
+
+    BODY = json.dumps([{"id": i, "title": f"Exercise {i}"} for i in range(200)]).encode()
+
+    def _process(self, body=None, headers=None, mimetype="application/json", headers_=None):
+        """Runs the after_request hook on a response; headers_ are the response's own headers."""
+        from flask import Response
+        app_module = _import_app()
+        with app_module.app.test_request_context(headers=headers or {}):
+            response = Response(self.BODY if body is None else body, mimetype=mimetype, headers=headers_)
+            return app_module.compress_and_validate(response)
+
+    def test_encoding_follows_accept_encoding(self):
+        import gzip
+        response = self._process(headers={"Accept-Encoding": "gzip, br;q=0"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.get_data()), self.BODY)
+        self.assertIn("Accept-Encoding", response.vary)
+        plain = self._process(headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(plain.get_data(), self.BODY)
+        self.assertIn("Accept-Encoding", plain.vary)
+
+    def test_matching_if_none_match_gets_304(self):
+        first = self._process(headers={"Accept-Encoding": "gzip"})
+        etag, weak = first.get_etag()
+        self.assertFalse(weak)
+        revalidated = self._process(headers={"Accept-Encoding": "gzip", "If-None-Match": f'"{etag}"'})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.get_data(), b"")
+        # The identity representation has its own ETag
+        other = self._process(headers={"If-None-Match": f'"{etag}"'})
+        self.assertEqual(other.status_code, 200)
+
+    def test_small_bodies_are_not_compressed(self):
+        response = self._process(body=b'{"ok": true}', headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.get_data(), b'{"ok": true}')
+        self.assertIsNotNone(response.get_etag()[0])
+
+    def test_encoded_and_streamed_responses_pass_through(self):
+        import gzip
+        precompressed = gzip.compress(self.BODY)
+        encoded = self._process(body=precompressed, headers={"Accept-Encoding": "gzip, br"},
+                                mimetype="text/html", headers_={"Content-Encoding": "gzip"})
+        self.assertEqual(encoded.get_data(), precompressed)
+        self.assertNotIn("ETag", encoded.headers)
+        streamed = self._process(body=iter([self.BODY]), headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", streamed.headers)
+        self.assertNotIn("ETag", streamed.headers)
+        self.assertEqual(streamed.get_data(), self.BODY)
+
+
+class TestMediaDownloader(unittest.TestCase):
+
+    class _Upstream:
+        """Streamed response whose second chunk is held back until `release` is set."""
+
+        def __init__(self, status=200):
+            self.status_code = status
+            self.headers = {"Content-Type": "video/mp4", "Content-Length": "6"}
+            self.release = threading.Event()
+
+        def iter_content(self, chunk_size):
+            yield b"abc"
+            self.release.wait(2)
+            yield b"def"
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    def test_streams_before_completion_and_coalesces(self):
+        import tempfile
+        upstream = self._Upstream()
+        with tempfile.TemporaryDirectory() as root, \
+                patch("media_cache.requests.get", return_value=upstream) as get:
+            path = os.path.join(root, "videos", "clip.mp4")
+            downloader = MediaDownloader()
+            first = downloader.start("https://cdn/clip.mp4", path)
+            self.assertIs(downloader.start("https://cdn/clip.mp4", path), first)
+            self.assertTrue(first.wait_for_headers(2))
+            chunks = first.stream()
+            self.assertEqual(next(chunks), b"abc")
+            self.assertFalse(os.path.exists(path))  # still a temp file
+            upstream.release.set()
+            self.assertEqual(b"".join(chunks), b"def")
+            self.assertTrue(first.wait(2))
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"abcdef")
+            self.assertEqual(os.listdir(os.path.dirname(path)), ["clip.mp4"])
+            self.assertEqual(downloader.fetch("https://cdn/clip.mp4", path), "cached")
+            self.assertEqual(get.call_count, 1)
+            self.assertEqual(downloader.stats()["coalesced"], 1)
+
+    def test_failed_download_leaves_nothing_behind(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as root, \
+                patch("media_cache.requests.get", return_value=self._Upstream(status=404)):
+            path = os.path.join(root, "clip.mp4")
+            self.assertTrue(MediaDownloader().fetch("https://cdn/clip.mp4", path, timeout=2).startswith("failed"))
+            self.assertEqual(os.listdir(root), [])
+
+    def test_reader_ends_cleanly_when_download_fails_midway(self):
+        import tempfile
+
+        class Broken(self._Upstream):
+            def iter_content(self, chunk_size):
+                yield b"abc"
+                self.release.wait(2)
+                raise requests.exceptions.ChunkedEncodingError("connection lost")
+
+        upstream = Broken()
+        with tempfile.TemporaryDirectory() as root, \
+                patch("media_cache.requests.get", return_value=upstream):
+            path = os.path.join(root, "clip.mp4")
+            download = MediaDownloader().start("https://cdn/clip.mp4", path)
+            self.assertTrue(download.wait_for_headers(2))
+            with download.cond:
+                download.cond.wait_for(lambda: download.written == 3, 2)
+            upstream.release.set()
+            self.assertTrue(download.wait(2))
+            # A reader that had not caught up yet gets a clean (short) end, not an error
+            self.assertEqual(b"".join(download.stream()), b"")
+            self.assertEqual(os.listdir(root), [])
+
+    def test_cache_index_tracks_completed_downloads(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, "images"))
+            for name, age in (("a.png", 60), ("b.png.1234abcd.part", 60), ("c.png.abcd1234.part", 0)):
+                path = os.path.join(root, "images", name)
+                open(path, "wb").close()
+                os.utime(path, (time.time() - age,) * 2)
+            index = MediaCacheIndex()
+            self.assertNotIn(os.path.join(root, "images", "a.png"), index)  # not loaded yet
+            self.assertEqual(index.load(root, partial_before=time.time() - 30), (1, 1))
+            self.assertIn(os.path.join(root, "images", "a.png"), index)
+            # The crash leftover is removed, the running download's temp file kept
+            self.assertEqual(sorted(os.listdir(os.path.join(root, "images"))), ["a.png", "c.png.abcd1234.part"])
+            background = MediaCacheIndex()
+            background.load_in_background(root)
+            self.assertTrue(background.ready.wait(5))
+            self.assertEqual(len(background), 1)
+            path = os.path.join(root, "videos", "clip.mp4")
+            upstream = self._Upstream()
+            upstream.release.set()
+            downloader = MediaDownloader(on_complete=lambda url, p: index.add(p))
+            with patch("media_cache.requests.get", return_value=upstream):
+                self.assertEqual(downloader.fetch("https://cdn/clip.mp4", path, timeout=2), "downloaded")
+            self.assertIn(path, index)
+
+    def test_discard_during_load_is_not_undone(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as root:
+            gone, kept = os.path.join(root, "gone.png"), os.path.join(root, "kept.png")
+            for path in (gone, kept):
+                open(path, "wb").close()
+            index = MediaCacheIndex()
+            real_walk = os.walk
+
+            def walk(top):
+                for entry in real_walk(top):
+                    yield entry
+                    # media_proxy found the file missing after the walk had listed it
+                    os.remove(gone)
+                    index.discard(gone)
+
+            with patch("media_cache.os.walk", side_effect=walk):
+                index.load(root)
+            self.assertNotIn(gone, index)
+            self.assertIn(kept, index)
+            index.discard(kept)
+            self.assertNotIn(kept, index)
+
+
+class TestMediaProxy(unittest.TestCase):
+
+    URL = "https://cdn.example/media/clip.mp4"
+
+    def setUp(self):
+        import tempfile
+        self.app_module = _import_app()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        patcher = patch.object(self.app_module, "CACHE_ROOT", self.root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.http = self.app_module.app.test_client()
+
+    def _get(self, headers=None):
+        return self.http.get("/media_proxy", query_string={"url": self.URL}, headers=headers or {})
+
+    def _cache(self, data=b"abcdef"):
+        os.makedirs(os.path.join(self.root, "videos"))
+        with open(os.path.join(self.root, "videos", "clip.mp4"), "wb") as f:
+            f.write(data)
+
+    def test_cached_file_answers_ranges(self):
+        self._cache()
+        response = self._get({"Range": "bytes=2-3"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers["Content-Range"], "bytes 2-3/6")
+        self.assertEqual(response.get_data(), b"cd")
+
+    def test_cached_file_revalidates(self):
+        self._cache()
+        first = self._get()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.cache_control.max_age, self.app_module.MEDIA_MAX_AGE)
+        by_etag = self._get({"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(by_etag.status_code, 304)
+        by_date = self._get({"If-Modified-Since": first.headers["Last-Modified"]})
+        self.assertEqual(by_date.status_code, 304)
+
+    def test_miss_streams_and_answers_ranges(self):
+        upstream = TestMediaDownloader._Upstream()
+        upstream.release.set()
+        with patch("media_cache.requests.get", return_value=upstream):
+            response = self._get({"Range": "bytes=2-"})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.headers["Content-Range"], "bytes 2-5/6")
+            self.assertEqual(response.headers["Content-Length"], "4")
+            self.assertEqual(response.get_data(), b"cdef")
+            self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        path = os.path.join(self.root, "videos", "clip.mp4")
+        self.assertIn(self.app_module.media_downloads.fetch(self.URL, path, timeout=2), ("cached", "downloaded"))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"abcdef")
+
+    def test_miss_without_length_refuses_ranges(self):
+        upstream = TestMediaDownloader._Upstream()
+        del upstream.headers["Content-Length"]
+        upstream.release.set()
+        with patch("media_cache.requests.get", return_value=upstream):
+            response = self._get({"Range": "bytes=2-"})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers["Accept-Ranges"], "none")
+            self.assertEqual(response.get_data(), b"abcdef")
+
+
+class TestClientPool(unittest.TestCase):
+
+    def test_clients_are_reused_and_idle_ones_evicted(self):
+        made = []
+
+        def factory(key):
+            c = MagicMock()
+            made.append(key)
+            return c
+
+        pool = ClientPool(factory, idle_ttl=60, max_clients=2)
+        a = pool.get("a")
+        self.assertIs(pool.get("a"), a)
+        pool.get("b")
+        pool.get("c")  # over capacity: "a" is the least recently used
+        self.assertEqual(len(pool), 2)
+        a.close.assert_called_once()
+        self.assertEqual(made, ["a", "b", "c"])
+
+        with patch('client_pool.time.monotonic', return_value=time.monotonic() + 120):
+            self.assertEqual(pool.evict_idle(), 2)
+        self.assertEqual(len(pool), 0)
+
+    def test_accounts_share_the_library_of_a_variant(self):
+        first, second = _make_client(), _make_client()
+        second._libraries = first._libraries
+        first.library_cache = [{"id": 1}]
+        self.assertIs(second.library_cache, first.library_cache)
+        second.device_type = 2
+        second.library_store.load.return_value = None
+        with patch('api_client.os.path.exists', return_value=False):
+            self.assertIsNone(second.library_cache)
+        self.assertEqual(first.library_cache, [{"id": 1}])
+
+
+class TestBatchDetailEngine(unittest.TestCase):
+
+    def test_failed_chunk_is_split_and_retried(self):
+        """A chunk that fails is retried as halves; only the bad id is dropped."""
+        client = _make_client()
+        calls = []
+
+        def fake_request(method, url, **kwargs):
+            ids = _ids_from_url(url)
+            calls.append(ids)
+            if 7 in ids:
+                # A bad id makes the whole list request fail
+                return _json_response(None, status=400)
+            return _json_response([{"id": gid} for gid in ids])
+
+        client._request = MagicMock(side_effect=fake_request)
+        details = client.fetch_batch_details(list(range(1, 21)))
+        self.assertEqual([d['id'] for d in details], [i for i in range(1, 21) if i != 7])
+        self.assertIn([7], calls)
+
+    def test_split_depth_is_bounded_and_transient_errors_are_not_split(self):
+        client = _make_client()
+        client.detail_chunk_size = 64
+        calls = []
+
+        def failing(status):
+            def fake_request(method, url, **kwargs):
+                calls.append(_ids_from_url(url))
+                return _json_response(None, status=status)
+            return fake_request
+
+        client._request = MagicMock(side_effect=failing(400))
+        with patch('api_client.DETAIL_SPLIT_MAX_DEPTH', 2):
+            self.assertEqual(client.fetch_batch_details(list(range(1, 65))), [])
+        # 1 + 2 + 4 requests: two levels of halving, then give up
+        self.assertEqual(len(calls), 7)
+
+        calls.clear()
+        with patch('api_client.DETAIL_RETRY_BUDGET', 6):
+            self.assertEqual(client.fetch_batch_details(list(range(1, 65))), [])
+        self.assertEqual(len(calls), 7)
+
+        calls.clear()
+        client._request = MagicMock(side_effect=failing(503))
+        self.assertEqual(client.fetch_batch_details(list(range(1, 65))), [])
+        self.assertEqual(len(calls), 1)
+
+        calls.clear()
+        client._request = MagicMock(side_effect=requests.exceptions.ConnectionError("down"))
+        self.assertEqual(client.fetch_batch_details(list(range(1, 65))), [])
+
+    def test_chunks_respect_url_length_limit(self):
+        client = _make_client()
+        client.detail_chunk_size = 150
+        ids = list(range(10 ** 9, 10 ** 9 + 1000))
+        with patch('api_client.MAX_URL_LENGTH', 500):
+            chunk = client._next_detail_chunk(ids, 0)
+        self.assertGreater(len(chunk), 0)
+        self.assertLess(len(chunk), 150)
+        self.assertLessEqual(len(client._batch_details_url(chunk)), 500)
+
+    def test_chunk_size_adapts_to_latency(self):
+        client = _make_client()
+        client.detail_chunk_size = 50
+        client._tune_detail_chunk_size([0.1, 0.2])
+        self.assertEqual(client.detail_chunk_size, 75)
+        client._tune_detail_chunk_size([3.0])
+        self.assertEqual(client.detail_chunk_size, 37)
+
+
 class TestLbsKgMath(unittest.TestCase):
     """
     Tests for the conversion math used by the frontend (extracted as pure Python).